@@ -0,0 +1,95 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>. 
+"""
+# Measures how long `layman <command>` takes from process start to exit, with
+# a stand-in daemon that acknowledges every command, and fails if the median
+# is over the limit. Run from the root of the repo:
+#
+#     python benchmarks/client_startup.py [--runs N] [--limit MS]
+from optparse import OptionParser
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+from threading import Thread
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAEMON_MODULES = ["i3ipc", "setproctitle", "tomli", "asyncio"]
+
+
+def serve(server):
+    while True:
+        client, _ = server.accept()
+        with client, client.makefile("rb") as lines:
+            for _ in lines:
+                client.sendall(b'{"success": true, "error": null, "elapsed": 0.0}\n')
+
+
+def timeRuns(args, env, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, env=env, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def report(name, times):
+    times = sorted(times)
+    p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+    print("%-24s median %6.1fms  p95 %6.1fms  min %6.1fms" % (name, statistics.median(times), p95, times[0]))
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--runs", dest="runs", type="int", default=30, help="Times to run each command.")
+    parser.add_option("--limit", dest="limit", type="float", default=50, help="Most milliseconds the median may take.")
+    options = parser.parse_args()[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Make the tree importable as the layman package without installing it
+        os.symlink(os.path.join(REPO, "src"), os.path.join(tmp, "layman"))
+        env = dict(os.environ, PYTHONPATH=tmp, XDG_RUNTIME_DIR=tmp)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(os.path.join(tmp, "layman.sock"))
+        server.listen()
+        Thread(target=serve, args=(server,), daemon=True).start()
+
+        # The client shouldn't pull in anything the daemon needs
+        check = "import sys, layman.__main__; print(' '.join(x for x in %r if x in sys.modules))" % DAEMON_MODULES
+        imported = subprocess.run([sys.executable, "-c", check], env=env, check=True,
+                                  capture_output=True, text=True).stdout.split()
+        if imported:
+            print("client imports daemon modules: %s" % ", ".join(imported))
+            return 1
+
+        report("python -c pass", timeRuns([sys.executable, "-c", "pass"], env, options.runs))
+        times = timeRuns([sys.executable, "-m", "layman", "nop"], env, options.runs)
+        report("layman nop", times)
+
+    if statistics.median(times) > options.limit:
+        print("client startup is over the %.0fms limit" % options.limit)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
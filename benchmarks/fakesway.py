@@ -0,0 +1,906 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+# A stand-in for sway's IPC socket, used by the benchmarks. FakeSway holds a
+# simulated container tree, and FakeIpcServer serves it to i3ipc connections.
+import json
+import os
+import selectors
+import socket
+import struct
+import tempfile
+from threading import Lock, Thread
+import time
+
+MAGIC = b"i3-ipc"
+HEADER = "=6sII"
+HEADER_SIZE = struct.calcsize(HEADER)
+
+MSG_COMMAND = 0
+MSG_GET_WORKSPACES = 1
+MSG_SUBSCRIBE = 2
+MSG_GET_OUTPUTS = 3
+MSG_GET_TREE = 4
+MSG_GET_MARKS = 5
+MSG_GET_BAR_CONFIG = 6
+MSG_GET_VERSION = 7
+MSG_GET_BINDING_MODES = 8
+MSG_GET_CONFIG = 9
+MSG_SEND_TICK = 10
+
+# Event message types are the index of the event in this list with the high bit set
+EVENTS = ["workspace", "output", "mode", "window", "barconfig_update", "binding", "shutdown", "tick"]
+
+PARALLEL = {
+    "left": ("splith", "tabbed"),
+    "right": ("splith", "tabbed"),
+    "up": ("splitv", "stacked"),
+    "down": ("splitv", "stacked"),
+}
+
+
+class FakeSway:
+    """
+    A simulated sway container tree. It applies the subset of sway commands
+    used by layman and the built-in layouts, and records the events sway would
+    emit in response so that FakeIpcServer can deliver them to subscribers.
+    """
+    def __init__(self, outputs=None):
+        self.nextId = 1
+        self.nodes = {}
+        self.parents = {}
+        self.events = []
+        self.root = self.createNode("root", "root", "splith", {"x": 0, "y": 0, "width": 0, "height": 0})
+        self.focusedId = None
+        for name, rect in (outputs or {"DP-1": (0, 0, 3840, 2160)}).items():
+            self.addOutput(name, rect)
+
+
+    """
+    Tree construction
+
+    The following functions build and tear down nodes in the simulated tree.
+    """
+
+    def createNode(self, nodeType, name, layout, rect):
+        node = {
+            "id": self.nextId,
+            "type": nodeType,
+            "name": name,
+            "layout": layout,
+            "orientation": "horizontal" if layout == "splith" else "vertical" if layout == "splitv" else "none",
+            "percent": None,
+            "rect": dict(rect),
+            "focused": False,
+            "focus": [],
+            "marks": [],
+            "fullscreen_mode": 0,
+            "urgent": False,
+            "sticky": False,
+            "border": "normal",
+            "nodes": [],
+            "floating_nodes": [],
+        }
+        self.nodes[node["id"]] = node
+        self.nextId += 1
+        return node
+
+
+    def addOutput(self, name, rect):
+        x, y, width, height = rect
+        output = self.createNode("output", name, "output", {"x": x, "y": y, "width": width, "height": height})
+        output["active"] = True
+        self.attach(output, self.root)
+        return output
+
+
+    # resizeOutput changes an output's size, like rotating or rescaling it.
+    def resizeOutput(self, name, width, height):
+        output = self.findOutput(name)
+        output["rect"]["width"] = width
+        output["rect"]["height"] = height
+        self.relayout()
+        self.emit("output", {"change": "unspecified"})
+
+
+    def addWorkspace(self, num, outputName=None):
+        output = self.findOutput(outputName) if outputName else self.root["nodes"][0]
+        workspace = self.createNode("workspace", str(num), "splith", output["rect"])
+        workspace["num"] = num
+        workspace["output"] = output["name"]
+        self.attach(workspace, output)
+        self.emit("workspace", {"change": "init", "current": workspace, "old": None})
+        return workspace
+
+
+    def openWindow(self, workspaceNum=None, appId="foot"):
+        workspace = self.findWorkspace(workspaceNum) if workspaceNum is not None else self.focusedWorkspace()
+        if workspace is None:
+            workspace = self.addWorkspace(workspaceNum)
+
+        window = self.createNode("con", appId, "none", workspace["rect"])
+        window["app_id"] = appId
+        window["pid"] = 1000 + window["id"]
+        window["visible"] = True
+
+        # New windows are placed after the focused container of their workspace
+        focused = self.nodes.get(self.focusedId)
+        if focused is not None and focused["type"] == "con" and self.workspaceOf(focused) is workspace \
+                and not self.isFloating(focused):
+            parent = self.parents[focused["id"]]
+            self.attach(window, parent, parent["nodes"].index(focused) + 1)
+        else:
+            self.attach(window, workspace)
+
+        self.relayout()
+        self.emit("window", {"change": "new", "container": window})
+        self.focus(window)
+        return window["id"]
+
+
+    def closeWindow(self, windowId):
+        window = self.nodes[windowId]
+        workspace = self.workspaceOf(window)
+        parent = self.parents[windowId]
+        self.detach(window)
+        del self.nodes[windowId]
+        self.relayout()
+        self.emit("window", {"change": "close", "container": window})
+
+        # Focus falls to the most recently focused remaining sibling
+        if self.focusedId == windowId:
+            self.focusedId = None
+            candidates = [x for x in self.leaves(parent if parent["id"] in self.nodes else workspace)]
+            if len(candidates) == 0:
+                candidates = self.leaves(workspace)
+            if len(candidates) > 0:
+                self.focus(candidates[0])
+            else:
+                self.setFocused(workspace)
+
+
+    # loadTree replaces the simulated tree with one reported by sway, such as
+    # the trees in a trace recorded with `layman --record`.
+    def loadTree(self, tree):
+        self.root = json.loads(json.dumps(tree))
+        self.nodes = {}
+        self.parents = {}
+        self.focusedId = None
+
+        def add(node, parent):
+            for key in ("nodes", "floating_nodes", "focus", "marks"):
+                node.setdefault(key, [])
+            node.setdefault("percent", None)
+            self.nodes[node["id"]] = node
+            if parent is not None:
+                self.parents[node["id"]] = parent
+            if node.get("focused"):
+                self.focusedId = node["id"]
+            for child in node["nodes"] + node["floating_nodes"]:
+                add(child, node)
+        add(self.root, None)
+        self.nextId = max(self.nodes) + 1
+
+
+    def attach(self, node, parent, index=None, floating=False):
+        children = parent["floating_nodes"] if floating else parent["nodes"]
+        if index is None:
+            children.append(node)
+        else:
+            children.insert(index, node)
+        self.parents[node["id"]] = parent
+        node["percent"] = None
+        for child in children:
+            child["percent"] = None
+
+
+    def detach(self, node):
+        parent = self.parents.pop(node["id"])
+        if node in parent["nodes"]:
+            parent["nodes"].remove(node)
+        else:
+            parent["floating_nodes"].remove(node)
+        if node["id"] in parent["focus"]:
+            parent["focus"].remove(node["id"])
+        for child in parent["nodes"]:
+            child["percent"] = None
+
+        # Reap split containers left empty
+        if parent["type"] == "con" and len(parent["nodes"]) == 0 and len(parent["floating_nodes"]) == 0:
+            self.detach(parent)
+            del self.nodes[parent["id"]]
+        return parent
+
+
+    """
+    Queries
+
+    The following functions look up nodes in the simulated tree.
+    """
+
+    def findOutput(self, name):
+        for output in self.root["nodes"]:
+            if output["name"] == name:
+                return output
+        return None
+
+
+    def findWorkspace(self, num):
+        for output in self.root["nodes"]:
+            for workspace in output["nodes"]:
+                if workspace.get("num") == num:
+                    return workspace
+        return None
+
+
+    def findMark(self, mark):
+        for node in self.nodes.values():
+            if mark in node["marks"]:
+                return node
+        return None
+
+
+    def workspaces(self):
+        return [w for o in self.root["nodes"] for w in o["nodes"]]
+
+
+    def workspaceOf(self, node):
+        while node is not None and node["type"] != "workspace":
+            node = self.parents.get(node["id"])
+        return node
+
+
+    def focusedWorkspace(self):
+        focused = self.nodes.get(self.focusedId)
+        if focused is None:
+            workspaces = self.workspaces()
+            return workspaces[0] if len(workspaces) > 0 else None
+        return self.workspaceOf(focused)
+
+
+    def leaves(self, node):
+        result = []
+        for child in node["nodes"]:
+            if len(child["nodes"]) == 0 and child["type"] == "con":
+                result.append(child)
+            else:
+                result.extend(self.leaves(child))
+        return result
+
+
+    def isFloating(self, node):
+        parent = self.parents.get(node["id"])
+        return parent is not None and node in parent["floating_nodes"]
+
+
+    def isAncestor(self, ancestor, node):
+        parent = self.parents.get(node["id"])
+        while parent is not None:
+            if parent is ancestor:
+                return True
+            parent = self.parents.get(parent["id"])
+        return False
+
+
+    """
+    Geometry
+
+    The following functions recompute container rects after the tree changes.
+    """
+
+    def relayout(self):
+        for output in self.root["nodes"]:
+            for workspace in output["nodes"]:
+                workspace["rect"] = dict(output["rect"])
+                self.layoutChildren(workspace)
+
+
+    def layoutChildren(self, node):
+        children = node["nodes"]
+        if len(children) == 0:
+            return
+
+        rect = node["rect"]
+        if node["layout"] in ("splith", "splitv"):
+            horizontal = node["layout"] == "splith"
+            if any(child["percent"] is None for child in children):
+                for child in children:
+                    child["percent"] = 1.0 / len(children)
+            total = sum(child["percent"] for child in children)
+            offset = rect["x"] if horizontal else rect["y"]
+            length = rect["width"] if horizontal else rect["height"]
+            for i, child in enumerate(children):
+                size = round(length * child["percent"] / total)
+                if i == len(children) - 1:
+                    size = (rect["x"] + rect["width"] if horizontal else rect["y"] + rect["height"]) - offset
+                if horizontal:
+                    child["rect"] = {"x": offset, "y": rect["y"], "width": size, "height": rect["height"]}
+                else:
+                    child["rect"] = {"x": rect["x"], "y": offset, "width": rect["width"], "height": size}
+                offset += size
+        else:
+            # Tabbed and stacked children all share the parent's rect
+            for child in children:
+                child["percent"] = 1.0 / len(children)
+                child["rect"] = dict(rect)
+
+        for child in children:
+            self.layoutChildren(child)
+
+
+    """
+    Commands
+
+    The following functions parse and apply sway commands against the tree.
+    """
+
+    def command(self, payload):
+        results = []
+        for segment in splitCommands(payload, ";"):
+            segment = segment.strip()
+            if segment == "":
+                continue
+
+            target = None
+            criteria = None
+            if segment.startswith("["):
+                end = segment.index("]")
+                criteria = segment[1:end]
+                segment = segment[end + 1:].strip()
+                target = self.matchCriteria(criteria)
+
+            for subCommand in splitCommands(segment, ","):
+                subCommand = subCommand.strip()
+                if criteria is not None and target is None:
+                    results.append({"success": False, "error": "No matching node."})
+                    continue
+                node = target if target is not None else self.nodes.get(self.focusedId) or self.focusedWorkspace()
+                try:
+                    error = self.apply(node, subCommand.split())
+                except (KeyError, ValueError, IndexError) as e:
+                    error = "Invalid command: %s" % e
+                results.append({"success": error is None} if error is None else {"success": False, "error": error})
+        self.relayout()
+        return results
+
+
+    def matchCriteria(self, criteria):
+        for token in criteria.split():
+            key, _, value = token.partition("=")
+            value = value.strip("\"'")
+            if key == "con_id":
+                return self.nodes.get(int(value))
+            if key == "con_mark":
+                return self.findMark(value)
+        return None
+
+
+    def apply(self, node, args):
+        name = args[0]
+        if name == "nop":
+            return None
+        if name == "mark":
+            return self.mark(node, args[1:])
+        if name == "unmark":
+            return self.unmark(node, args[1:])
+        if name == "move":
+            return self.move(node, args[1:])
+        if name == "swap":
+            return self.swap(node, int(args[-1]))
+        if name == "layout":
+            return self.setLayout(node, args[1:])
+        if name in ("split", "splitv", "splith", "splitt"):
+            return self.split(node, args[1] if name == "split" else name[-1])
+        if name == "resize":
+            return self.resize(node, args[1:])
+        if name == "focus":
+            if len(args) == 1:
+                self.focus(node)
+            return None
+        if name == "kill":
+            if node["type"] != "con":
+                return "Can only kill windows"
+            self.closeWindow(node["id"])
+            return None
+        if name == "floating":
+            return self.setFloating(node, args[1])
+        return "Unknown/invalid command '%s'" % name
+
+
+    def mark(self, node, args):
+        marks = [x for x in args if not x.startswith("--")]
+        for mark in marks:
+            previous = self.findMark(mark)
+            if previous is not None:
+                previous["marks"].remove(mark)
+            if "--toggle" in args and previous is node:
+                continue
+            node["marks"].append(mark)
+        self.emit("window", {"change": "mark", "container": node})
+        return None
+
+
+    def unmark(self, node, args):
+        if len(args) == 0:
+            node["marks"] = []
+        elif args[0] in node["marks"]:
+            node["marks"].remove(args[0])
+        self.emit("window", {"change": "mark", "container": node})
+        return None
+
+
+    def move(self, node, args):
+        args = [x for x in args if x not in ("window", "container", "to")]
+        if node["type"] not in ("con", "floating_con"):
+            return "Can only move containers"
+
+        if args[0] == "mark":
+            destination = self.findMark(args[1])
+            if destination is None:
+                return "Mark '%s' not found" % args[1]
+            self.moveToContainer(node, destination)
+        elif args[0] == "workspace":
+            num = int(args[-1])
+            workspace = self.findWorkspace(num) or self.addWorkspace(num)
+            self.moveToContainer(node, workspace)
+        elif args[0] in PARALLEL:
+            self.moveInDirection(node, args[0])
+        else:
+            return "Invalid move command"
+
+        self.emit("window", {"change": "move", "container": node})
+        return None
+
+
+    def moveToContainer(self, node, destination):
+        if node is destination or self.isAncestor(node, destination) or self.isAncestor(destination, node):
+            return
+        if destination["type"] == "workspace" and self.workspaceOf(node) is destination:
+            return
+
+        self.detach(node)
+        if destination["type"] == "con" and len(destination["nodes"]) == 0:
+            # Leaf destinations take the moved container as their next sibling
+            parent = self.parents[destination["id"]]
+            self.attach(node, parent, parent["nodes"].index(destination) + 1)
+        else:
+            self.attach(node, destination)
+
+
+    def moveInDirection(self, node, direction):
+        offset = -1 if direction in ("left", "up") else 1
+        current = node
+        while current["type"] != "workspace":
+            parent = self.parents[current["id"]]
+            siblings = parent["nodes"]
+            index = siblings.index(current)
+            desired = index + offset
+            if parent["layout"] in PARALLEL[direction] and len(siblings) > 1:
+                if current is node and 0 <= desired < len(siblings):
+                    sibling = siblings[desired]
+                    if len(sibling["nodes"]) == 0:
+                        siblings[index], siblings[desired] = sibling, node
+                    else:
+                        self.detach(node)
+                        self.attach(node, sibling, 0 if offset > 0 else None)
+                    return
+                if current is not node:
+                    # current is reaped if node was all that was left in it
+                    self.detach(node)
+                    if current in siblings:
+                        index = siblings.index(current) + (0 if offset < 0 else 1)
+                    self.attach(node, parent, index)
+                    return
+            current = parent
+
+        # Nothing parallel, rejigger the workspace around the moved container
+        workspace = current
+        if workspace["layout"] in PARALLEL[direction] and self.parents[node["id"]] is workspace:
+            return
+        self.detach(node)
+        if len(workspace["nodes"]) > 1:
+            wrapper = self.createNode("con", "", workspace["layout"], workspace["rect"])
+            for child in list(workspace["nodes"]):
+                self.detach(child)
+                self.attach(child, wrapper)
+            self.attach(wrapper, workspace)
+        workspace["layout"] = PARALLEL[direction][0]
+        self.attach(node, workspace, 0 if offset < 0 else None)
+
+
+    def swap(self, node, otherId):
+        other = self.nodes.get(otherId)
+        if other is None:
+            return "Failed to find con_id %d" % otherId
+        if node is other or self.isAncestor(node, other) or self.isAncestor(other, node):
+            return "Cannot swap ancestor and descendant"
+
+        nodeParent = self.parents[node["id"]]
+        otherParent = self.parents[other["id"]]
+        nodeIndex = nodeParent["nodes"].index(node)
+        otherIndex = otherParent["nodes"].index(other)
+        nodeParent["nodes"][nodeIndex] = other
+        otherParent["nodes"][otherIndex] = node
+        self.parents[node["id"]] = otherParent
+        self.parents[other["id"]] = nodeParent
+        node["percent"], other["percent"] = other["percent"], node["percent"]
+        return None
+
+
+    def setLayout(self, node, args):
+        # Like i3, layout operates on the parent of the target
+        container = self.parents.get(node["id"], node) if node["type"] == "con" else node
+        layout = args[0]
+        if layout == "stacking":
+            layout = "stacked"
+        if layout == "toggle":
+            layout = "splitv" if container["layout"] == "splith" else "splith"
+        if layout not in ("splith", "splitv", "tabbed", "stacked"):
+            return "Invalid layout %s" % layout
+        container["layout"] = layout
+        return None
+
+
+    def split(self, node, direction):
+        if node["type"] != "con":
+            return None
+        direction = direction[0]
+        parent = self.parents[node["id"]]
+        if direction == "n":
+            # Unsplit: replace a single child parent with the child
+            if parent["type"] == "con" and len(parent["nodes"]) == 1:
+                grandParent = self.parents[parent["id"]]
+                index = grandParent["nodes"].index(parent)
+                self.detach(node)
+                self.attach(node, grandParent, index)
+            return None
+        if direction == "t":
+            direction = "v" if parent["layout"] == "splith" else "h"
+
+        layout = "splitv" if direction == "v" else "splith"
+        if len(parent["nodes"]) == 1 and parent["layout"] in ("splith", "splitv"):
+            parent["layout"] = layout
+            return None
+
+        wrapper = self.createNode("con", "", layout, node["rect"])
+        index = parent["nodes"].index(node)
+        percent = node["percent"]
+        parent["nodes"][index] = wrapper
+        self.parents[wrapper["id"]] = parent
+        wrapper["percent"] = percent
+        self.parents[node["id"]] = wrapper
+        wrapper["nodes"].append(node)
+        node["percent"] = None
+        return None
+
+
+    def resize(self, node, args):
+        args = [x for x in args if x not in ("set", "width", "height")]
+        if len(args) == 0:
+            return "Invalid resize"
+        value = int(args[0])
+        current = node
+        while current["type"] == "con":
+            parent = self.parents[current["id"]]
+            if parent["layout"] == "splith" and len(parent["nodes"]) > 1:
+                others = [x for x in parent["nodes"] if x is not current]
+                current["percent"] = value / 100
+                for other in others:
+                    other["percent"] = (1 - current["percent"]) / len(others)
+                return None
+            current = parent
+        return "Cannot resize"
+
+
+    def setFloating(self, node, state):
+        floating = self.isFloating(node)
+        if state == "toggle":
+            state = "disable" if floating else "enable"
+        workspace = self.workspaceOf(node)
+        if state == "enable" and not floating:
+            self.detach(node)
+            node["type"] = "floating_con"
+            self.attach(node, workspace, floating=True)
+        elif state == "disable" and floating:
+            self.detach(node)
+            node["type"] = "con"
+            self.attach(node, workspace)
+        else:
+            return None
+        self.relayout()
+        self.emit("window", {"change": "floating", "container": node})
+        return None
+
+
+    def focus(self, node):
+        if node["type"] == "workspace":
+            self.setFocused(node)
+            return
+        if self.focusedId == node["id"]:
+            return
+        previousWorkspace = self.focusedWorkspace()
+        self.setFocused(node)
+        workspace = self.workspaceOf(node)
+        if previousWorkspace is not workspace:
+            self.emit("workspace", {"change": "focus", "current": workspace, "old": previousWorkspace})
+        self.emit("window", {"change": "focus", "container": node})
+
+
+    def setFocused(self, node):
+        previous = self.nodes.get(self.focusedId)
+        if previous is not None:
+            previous["focused"] = False
+        node["focused"] = True
+        self.focusedId = node["id"]
+
+        # Keep each ancestor's focus stack pointing at the focused node
+        child = node
+        parent = self.parents.get(child["id"])
+        while parent is not None:
+            if child["id"] in parent["focus"]:
+                parent["focus"].remove(child["id"])
+            parent["focus"].insert(0, child["id"])
+            child = parent
+            parent = self.parents.get(child["id"])
+
+
+    """
+    Events and replies
+
+    The following functions serialize state the way sway reports it over IPC.
+    """
+
+    def emit(self, event, payload):
+        self.events.append((event, json.loads(json.dumps(payload))))
+
+
+    def getWorkspaces(self):
+        focusedWorkspace = self.focusedWorkspace()
+        return [{
+            "id": w["id"],
+            "num": w["num"],
+            "name": w["name"],
+            "visible": True,
+            "focused": w is focusedWorkspace,
+            "urgent": False,
+            "rect": w["rect"],
+            "output": w["output"],
+            "layout": w["layout"],
+            "type": "workspace",
+        } for w in self.workspaces()]
+
+
+    def getOutputs(self):
+        return [{
+            "name": o["name"],
+            "active": True,
+            "primary": False,
+            "rect": o["rect"],
+            "current_workspace": o["nodes"][0]["name"] if len(o["nodes"]) > 0 else None,
+        } for o in self.root["nodes"]]
+
+
+    def getTree(self):
+        return self.root
+
+
+    def getMarks(self):
+        return [mark for node in self.nodes.values() for mark in node["marks"]]
+
+
+def splitCommands(payload, separator):
+    parts = []
+    depth = 0
+    quote = None
+    current = ""
+    for char in payload:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        current += char
+    parts.append(current)
+    return parts
+
+
+class FakeIpcServer:
+    """
+    Serves a FakeSway tree over a unix socket that speaks the i3/sway IPC
+    protocol, so that i3ipc.Connection and layman can run against it unchanged.
+    Message and byte counts are kept per message type for benchmarking.
+
+    With commandEvents off, commands still change the tree but their events
+    aren't sent, for replaying traces that already hold them.
+    """
+    def __init__(self, sway=None, socketPath=None, commandEvents=True):
+        self.sway = sway or FakeSway()
+        self.commandEvents = commandEvents
+        self.socketPath = socketPath or os.path.join(tempfile.mkdtemp(prefix="layman-fake-"), "ipc.sock")
+        self.lock = Lock()
+        self.subscribers = {}
+        self.buffers = {}
+        self.lastActivity = time.perf_counter()
+        self.resetCounters()
+
+        self.selector = selectors.DefaultSelector()
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socketPath)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.running = True
+        self.thread = Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+
+    def resetCounters(self):
+        self.messages = {}
+        self.bytesIn = 0
+        self.bytesOut = 0
+
+
+    def counters(self):
+        with self.lock:
+            return {
+                "messages": dict(self.messages),
+                "total": sum(self.messages.values()),
+                "bytesIn": self.bytesIn,
+                "bytesOut": self.bytesOut,
+            }
+
+
+    def serve(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.05):
+                if key.fileobj is self.server:
+                    client, _ = self.server.accept()
+                    self.buffers[client] = b""
+                    self.selector.register(client, selectors.EVENT_READ)
+                else:
+                    self.read(key.fileobj)
+
+
+    def read(self, client):
+        try:
+            data = client.recv(65536)
+        except OSError:
+            data = b""
+        if len(data) == 0:
+            self.drop(client)
+            return
+
+        buffer = self.buffers[client] + data
+        while len(buffer) >= HEADER_SIZE:
+            _, length, messageType = struct.unpack(HEADER, buffer[:HEADER_SIZE])
+            if len(buffer) < HEADER_SIZE + length:
+                break
+            payload = buffer[HEADER_SIZE:HEADER_SIZE + length].decode()
+            buffer = buffer[HEADER_SIZE + length:]
+            with self.lock:
+                self.messages[messageType] = self.messages.get(messageType, 0) + 1
+                self.bytesIn += HEADER_SIZE + length
+                reply = self.handle(client, messageType, payload)
+                self.send(client, messageType, reply)
+                if messageType == MSG_COMMAND and not self.commandEvents:
+                    self.sway.events = []
+                self.flushEvents()
+                self.lastActivity = time.perf_counter()
+        self.buffers[client] = buffer
+
+
+    def drop(self, client):
+        self.selector.unregister(client)
+        self.buffers.pop(client, None)
+        with self.lock:
+            self.subscribers.pop(client, None)
+        client.close()
+
+
+    def handle(self, client, messageType, payload):
+        if messageType == MSG_COMMAND:
+            return self.sway.command(payload)
+        if messageType == MSG_GET_WORKSPACES:
+            return self.sway.getWorkspaces()
+        if messageType == MSG_SUBSCRIBE:
+            self.subscribers.setdefault(client, set()).update(json.loads(payload))
+            return {"success": True}
+        if messageType == MSG_GET_OUTPUTS:
+            return self.sway.getOutputs()
+        if messageType == MSG_GET_TREE:
+            return self.sway.getTree()
+        if messageType == MSG_GET_MARKS:
+            return self.sway.getMarks()
+        if messageType == MSG_GET_VERSION:
+            return {"major": 1, "minor": 8, "patch": 0, "human_readable": "1.8 (fake)",
+                    "loaded_config_file_name": ""}
+        if messageType == MSG_GET_BINDING_MODES:
+            return ["default"]
+        if messageType == MSG_SEND_TICK:
+            return {"success": True}
+        return {"success": False}
+
+
+    def send(self, client, messageType, payload):
+        body = json.dumps(payload).encode()
+        message = struct.pack(HEADER, MAGIC, len(body), messageType) + body
+        self.bytesOut += len(message)
+        try:
+            client.sendall(message)
+        except OSError:
+            pass
+
+
+    def flushEvents(self):
+        events = self.sway.events
+        self.sway.events = []
+        for event, payload in events:
+            messageType = (1 << 31) | EVENTS.index(event)
+            for client, subscriptions in list(self.subscribers.items()):
+                if event in subscriptions:
+                    self.send(client, messageType, payload)
+
+
+    def run(self, action, *args, **kwargs):
+        # Apply a scripted action to the tree and deliver the events it causes
+        with self.lock:
+            result = action(*args, **kwargs)
+            self.flushEvents()
+            self.lastActivity = time.perf_counter()
+        return result
+
+
+    def pressBinding(self, command):
+        def binding():
+            self.sway.emit("binding", {"change": "run", "binding": {
+                "command": command, "event_state_mask": [], "input_code": 0,
+                "symbol": None, "input_type": "keyboard"}})
+        self.run(binding)
+
+
+    def waitIdle(self, idle=0.05, timeout=10):
+        # Wait until nothing has talked to the server for `idle` seconds and
+        # return the time of the last message handled
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            with self.lock:
+                last = self.lastActivity
+            if time.perf_counter() - last >= idle:
+                return last
+            time.sleep(idle / 5)
+        return self.lastActivity
+
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.selector.close()
+        self.server.close()
+        for client in list(self.buffers):
+            client.close()
+        try:
+            os.unlink(self.socketPath)
+        except OSError:
+            pass
@@ -0,0 +1,276 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Runs layman and each built-in manager through scripted scenarios against
+# FakeIpcServer, and reports wall time, IPC messages and bytes per operation.
+# Run from the root of the repo:
+#
+#     python benchmarks/managers.py [--windows N] [--json results.json]
+#
+# Managers are first driven directly, by calling their handlers the way layman
+# would, which times the manager alone. Then the layman daemon is run against
+# the fake socket, which times whole events from sway's side, including routing
+# and the workers. Times are from the fake server, so they include IPC. The run
+# fails if layman logs an error, like an exception raised by a manager.
+import json
+import logging
+from optparse import OptionParser
+import os
+import statistics
+import sys
+import tempfile
+from threading import Thread
+import time
+
+from fakesway import FakeIpcServer, FakeSway
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYOUTS = ["MasterStack", "Grid", "Autotiling"]
+MASTERSTACK_BINDINGS = ["swap master", "rotate cw", "rotate ccw", "move up", "move down", "stack toggle"]
+
+
+# importLayman makes the tree importable as the layman package without
+# installing it, and points it at a config that sets up the given layouts, or
+# at the given config text.
+def importLayman(tmp, layouts=(), configText=None):
+    os.symlink(os.path.join(REPO, "src"), os.path.join(tmp, "layman"))
+    sys.path.insert(0, tmp)
+
+    configPath = os.path.join(tmp, "config.toml")
+    with open(configPath, "w") as config:
+        if configText is not None:
+            config.write(configText)
+        else:
+            config.write("[layman]\ndefaultLayout = \"none\"\ndebug = false\n")
+        for num, layout in enumerate(layouts, 1):
+            config.write("\n[workspace.%d]\ndefaultLayout = \"%s\"\n" % (num, layout))
+    sys.argv = [sys.argv[0], "-c", configPath]
+    return configPath
+
+
+class Event:
+    def __init__(self, change, container=None):
+        self.change = change
+        self.container = container
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+
+    def emit(self, record):
+        self.count += 1
+
+
+# countErrors starts counting the errors layman logs.
+def countErrors():
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    return errors
+
+
+# checkErrors returns the exit status for a run, printing why it failed.
+def checkErrors(errors):
+    if errors.count > 0:
+        print("layman logged %d errors, the results are not valid" % errors.count, file=sys.stderr)
+        return 1
+    return 0
+
+
+class Results:
+    def __init__(self):
+        self.rows = {}
+
+
+    def add(self, scenario, operation, elapsed, counters):
+        row = self.rows.setdefault((scenario, operation), {"times": [], "messages": 0, "bytes": 0})
+        row["times"].append(elapsed * 1000)
+        row["messages"] += counters["total"]
+        row["bytes"] += counters["bytesIn"] + counters["bytesOut"]
+
+
+    def report(self):
+        results = []
+        for (scenario, operation), row in self.rows.items():
+            times = sorted(row["times"])
+            count = len(times)
+            results.append({
+                "scenario": scenario,
+                "operation": operation,
+                "count": count,
+                "meanMs": round(statistics.mean(times), 3),
+                "p95Ms": round(times[min(count - 1, int(count * 0.95))], 3),
+                "messagesPerOp": round(row["messages"] / count, 2),
+                "bytesPerOp": round(row["bytes"] / count),
+            })
+        return results
+
+
+def printResults(results):
+    print("%-24s %-22s %5s %9s %9s %8s %9s" % ("scenario", "operation", "count", "mean ms", "p95 ms", "msgs/op", "bytes/op"))
+    for row in results:
+        print("%-24s %-22s %5d %9.3f %9.3f %8.2f %9d" % (row["scenario"], row["operation"], row["count"],
+              row["meanMs"], row["p95Ms"], row["messagesPerOp"], row["bytesPerOp"]))
+
+
+"""
+Direct manager scenarios
+
+The following functions call a manager's handlers on the calling thread, with
+a LaymanConnection to the fake socket, the way a layman worker does.
+"""
+
+def benchmarkManager(results, layout, windows):
+    from i3ipc import Connection
+    from layman import config, utils
+    from layman.connection import LaymanConnection
+    from layman.layman import Layman
+
+    sway = FakeSway()
+    sway.addWorkspace(1)
+    server = FakeIpcServer(sway)
+    os.environ["SWAYSOCK"] = server.socketPath
+    con = LaymanConnection(Connection(server.socketPath))
+    options = config.LaymanConfig(con, utils.getConfigPath())
+
+    layman = Layman()
+    layman.fetchLayouts()
+    name = layman.getLayoutNameByShortName(layout)
+    manager = getattr(layman.userLayouts[name], name)(con, con.get_tree().find_by_id(sway.findWorkspace(1)["id"]), options)
+    scenario = "manager %s" % layout
+
+    def call(operation, handler, *args):
+        con.update()
+        server.resetCounters()
+        start = time.perf_counter()
+        with manager.batch():
+            handler(*args)
+        elapsed = time.perf_counter() - start
+        results.add(scenario, operation, elapsed, server.counters())
+
+    ids = []
+    for _ in range(windows):
+        windowId = server.run(sway.openWindow, 1)
+        ids.append(windowId)
+        window = con.get_tree().find_by_id(windowId)
+        call("windowAdded", manager.windowAdded, Event("new", window), window)
+
+    for windowId in ids:
+        server.run(sway.focus, sway.nodes[windowId])
+        con.invalidate()
+        window = con.get_tree().find_by_id(windowId)
+        call("windowFocused", manager.windowFocused, Event("focus", window), window)
+
+    if layout == "MasterStack":
+        for command in MASTERSTACK_BINDINGS:
+            for _ in range(3):
+                call("binding " + command, manager.onBinding, command)
+
+    for windowId in reversed(ids):
+        con.invalidate()
+        window = con.get_tree().find_by_id(windowId)
+        server.run(sway.closeWindow, windowId)
+        call("windowRemoved", manager.windowRemoved, Event("close", window), window)
+
+    con.con.main_quit()
+    server.close()
+
+
+"""
+Daemon scenarios
+
+The following functions run the layman daemon against the fake socket and
+time each scripted action from when it's applied until layman goes quiet.
+"""
+
+def benchmarkDaemon(results, windows):
+    from layman.layman import Layman
+
+    sway = FakeSway()
+    for num in range(1, len(LAYOUTS) + 1):
+        sway.addWorkspace(num)
+    server = FakeIpcServer(sway)
+    os.environ["SWAYSOCK"] = server.socketPath
+    os.environ["XDG_RUNTIME_DIR"] = os.path.dirname(server.socketPath)
+
+    layman = Layman()
+    Thread(target=layman.init, daemon=True).start()
+    server.waitIdle(0.2)
+
+    def step(scenario, operation, action, *args):
+        server.waitIdle()
+        server.resetCounters()
+        start = time.perf_counter()
+        result = server.run(action, *args)
+        last = server.waitIdle()
+        results.add(scenario, operation, last - start, server.counters())
+        return result
+
+    for num, layout in enumerate(LAYOUTS, 1):
+        scenario = "layman %s" % layout
+        ids = [step(scenario, "open window", sway.openWindow, num) for _ in range(windows)]
+        for windowId in ids:
+            step(scenario, "focus window", sway.focus, sway.nodes[windowId])
+        if layout == "MasterStack":
+            for command in MASTERSTACK_BINDINGS:
+                step(scenario, "binding " + command, server.sway.emit, "binding", {"change": "run", "binding": {
+                    "command": "nop layman " + command, "event_state_mask": [], "input_code": 0,
+                    "symbol": None, "input_type": "keyboard"}})
+        rect = sway.findOutput("DP-1")["rect"]
+        width, height = rect["width"], rect["height"]
+        step(scenario, "rotate output", sway.resizeOutput, "DP-1", height, width)
+        step(scenario, "rotate output", sway.resizeOutput, "DP-1", width, height)
+        for windowId in reversed(ids):
+            step(scenario, "close window", sway.closeWindow, windowId)
+
+    # Focus storms should mostly be merged before they reach a manager
+    ids = [server.run(sway.openWindow, 1) for _ in range(windows)]
+    server.waitIdle()
+    server.resetCounters()
+    start = time.perf_counter()
+    for _ in range(10):
+        for windowId in ids:
+            server.run(sway.focus, sway.nodes[windowId])
+    results.add("layman focus storm", "%d focus events" % (10 * windows), server.waitIdle() - start, server.counters())
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--windows", dest="windows", type="int", default=8, help="Windows to open in each scenario.")
+    parser.add_option("--json", dest="json", type="string", help="Also write the results to this file.")
+    options = parser.parse_args()[0]
+
+    results = Results()
+    errors = countErrors()
+    with tempfile.TemporaryDirectory() as tmp:
+        importLayman(tmp, LAYOUTS)
+        for layout in LAYOUTS:
+            benchmarkManager(results, layout, options.windows)
+        benchmarkDaemon(results, options.windows)
+
+    report = results.report()
+    printResults(report)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=4)
+    return checkErrors(errors)
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,157 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Replays a trace recorded with `layman --record trace.jsonl` against
+# FakeIpcServer, and reports how layman handled it. Run from the root of the
+# repo:
+#
+#     python benchmarks/replay.py trace.jsonl [--speed N] [--json results.json]
+#
+# The fake tree starts as the recorded one, and is replaced with each tree
+# layman saw while routing an event before that event is sent, so managers
+# get the input they got when it was recorded. The events sway sent in reply
+# to layman's commands are in the trace, so the fake server doesn't send its
+# own. Events are sent at the recorded pace, scaled by --speed. With --speed 0
+# they're sent as fast as possible, each one once layman has finished with
+# the last.
+import json
+from optparse import OptionParser
+import os
+import socket
+import tempfile
+from threading import Thread
+import time
+
+from fakesway import FakeIpcServer, FakeSway
+from managers import importLayman
+
+
+def loadTrace(path):
+    from layman import trace
+    records = trace.readTrace(path)
+    if len(records) == 0 or records[0]["kind"] != "header":
+        raise ValueError("%s is not a layman trace" % path)
+    if records[0]["version"] != trace.TRACE_VERSION:
+        raise ValueError("%s is trace version %d, expected %d" % (path, records[0]["version"], trace.TRACE_VERSION))
+
+    trees = {x["seq"]: x["tree"] for x in records if x["kind"] == "tree"}
+    inputs = [x for x in records if x["kind"] in ("event", "command")]
+    return records[0], inputs, trees
+
+
+# sendCommand sends a command on the control socket and returns layman's reply.
+def sendCommand(client, command):
+    client.sendall((command + "\n").encode())
+    line = b""
+    while not line.endswith(b"\n"):
+        data = client.recv(4096)
+        if not data:
+            break
+        line += data
+    return json.loads(line)
+
+
+def replay(header, inputs, trees, speed):
+    from layman import client
+    from layman.layman import Layman
+
+    sway = FakeSway()
+    sway.loadTree(header["tree"])
+    server = FakeIpcServer(sway, commandEvents=False)
+    os.environ["SWAYSOCK"] = server.socketPath
+    os.environ["XDG_RUNTIME_DIR"] = os.path.dirname(server.socketPath)
+
+    layman = Layman()
+    Thread(target=layman.init, daemon=True).start()
+    server.waitIdle(0.2)
+    control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    control.connect(client.getSocketPath())
+
+    server.resetCounters()
+    failed = 0
+    start = time.perf_counter()
+    for record in inputs:
+        if speed > 0:
+            delay = start + record["t"] / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            server.waitIdle(0.02)
+
+        if record["kind"] == "command":
+            if not sendCommand(control, record["command"])["success"]:
+                failed += 1
+            continue
+        tree = trees.get(record["seq"])
+        if tree is not None:
+            server.run(sway.loadTree, tree)
+        server.run(sway.emit, record["type"], record["payload"])
+    elapsed = server.waitIdle(0.2) - start
+    control.close()
+
+    return {
+        "events": sum(1 for x in inputs if x["kind"] == "event"),
+        "commands": sum(1 for x in inputs if x["kind"] == "command"),
+        "failedCommands": failed,
+        "recordedSeconds": round(inputs[-1]["t"] if inputs else 0, 3),
+        "replaySeconds": round(elapsed, 3),
+        "ipc": server.counters(),
+        "queue": layman.intake.stats(),
+        "stats": layman.stats.report(),
+    }
+
+
+def printResults(results):
+    print("%d events and %d commands (%d failed), recorded over %.3fs, replayed in %.3fs" % (
+        results["events"], results["commands"], results["failedCommands"],
+        results["recordedSeconds"], results["replaySeconds"]))
+    print("%d IPC messages, %d bytes" % (results["ipc"]["total"], results["ipc"]["bytesIn"] + results["ipc"]["bytesOut"]))
+    print()
+    print("%-40s %5s %9s %9s %9s %8s %8s" % ("event", "count", "p50 ms", "p95 ms", "p99 ms", "fetches", "commands"))
+    for name, row in results["stats"].items():
+        latency = row["latency"]
+        print("%-40s %5d %9.3f %9.3f %9.3f %8d %8d" % (name, latency["count"], latency["p50"], latency["p95"],
+              latency["p99"], row["fetches"], row["commands"]))
+
+
+def main():
+    parser = OptionParser(usage="%prog trace.jsonl [options]")
+    parser.add_option("--speed", dest="speed", type="float", default=1.0,
+                      help="Multiple of the recorded pace to replay at, 0 replays as fast as possible.")
+    parser.add_option("--json", dest="json", type="string", help="Also write the results to this file.")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected a trace file")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The layman package is needed to read the trace, so link it first
+        importLayman(tmp)
+        header, inputs, trees = loadTrace(args[0])
+        if header["config"] is not None:
+            with open(os.path.join(tmp, "config.toml"), "w") as config:
+                config.write(header["config"])
+        results = replay(header, inputs, trees, options.speed)
+
+    printResults(results)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,101 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Measures how long the layman daemon takes to start against a session that
+# already has windows open, until every workspace has been arranged, and the
+# IPC messages and bytes it took. It's then started again, which restores the
+# state saved by the first daemon. Run from the root of the repo:
+#
+#     python benchmarks/startup.py [--workspaces N] [--windows N] [--json results.json]
+#
+# Windows are spread evenly over the workspaces. Each built-in layout is
+# started on its own fake socket, with every workspace set to that layout.
+import json
+from optparse import OptionParser
+import os
+import tempfile
+from threading import Thread
+import time
+
+from fakesway import FakeIpcServer, FakeSway
+from managers import LAYOUTS, Results, checkErrors, countErrors, importLayman, printResults
+
+CONFIG = "[layman]\ndefaultLayout = \"%s\"\nwatchConfig = false\n"
+
+
+def createSession(workspaces, windows):
+    sway = FakeSway()
+    for num in range(1, workspaces + 1):
+        sway.addWorkspace(num)
+    for i in range(windows):
+        sway.openWindow(i % workspaces + 1)
+
+    # Nothing was listening when these happened
+    sway.events = []
+    return sway
+
+
+def benchmarkStartup(results, configPath, layout, workspaces, windows):
+    from layman.layman import Layman
+
+    with open(configPath, "w") as config:
+        config.write(CONFIG % layout)
+
+    server = FakeIpcServer(createSession(workspaces, windows))
+    os.environ["SWAYSOCK"] = server.socketPath
+    os.environ["XDG_RUNTIME_DIR"] = os.path.dirname(server.socketPath)
+
+    # The server is left running afterwards, so the daemon doesn't restart
+    # against the next layout's socket
+    operation = "%d windows on %d workspaces" % (windows, workspaces)
+    start = time.perf_counter()
+    server.run(Thread(target=Layman().init, daemon=True).start)
+    last = server.waitIdle(0.5, 60)
+    results.add("startup %s" % layout, operation, last - start, server.counters())
+
+    # A second daemon finds the state saved by the first, like after a crash
+    server.resetCounters()
+    start = time.perf_counter()
+    server.run(Thread(target=Layman().init, daemon=True).start)
+    last = server.waitIdle(0.5, 60)
+    results.add("restart %s" % layout, operation, last - start, server.counters())
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--workspaces", dest="workspaces", type="int", default=10, help="Workspaces to open windows on.")
+    parser.add_option("--windows", dest="windows", type="int", default=100, help="Windows open before layman starts.")
+    parser.add_option("--json", dest="json", type="string", help="Also write the results to this file.")
+    options = parser.parse_args()[0]
+
+    results = Results()
+    errors = countErrors()
+    with tempfile.TemporaryDirectory() as tmp:
+        configPath = importLayman(tmp)
+        for layout in LAYOUTS:
+            benchmarkStartup(results, configPath, layout, options.workspaces, options.windows)
+
+    report = results.report()
+    printResults(report)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=4)
+    return checkErrors(errors)
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -17,22 +17,25 @@ layman. If not, see <https://www.gnu.org/licenses/>.
 """
 import sys
 
-from . import layman
-from .server import PIPE
+from .client import sendCommand
 
 def main():
     """Application entry point."""
 
-    # Write command if args were passed
-    if len(sys.argv) > 1:
-        command = ' '.join(sys.argv).replace("%s " % sys.argv[0], '')
-        pipe = open(PIPE, "w")
-        pipe.write(command)
-        pipe.close()
-        exit()
+    # Send command if args were passed, and wait for it to be handled. The
+    # daemon's imports are left until it's known they're needed, since this
+    # runs for every command sent from a keybinding.
+    if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
+        exit(sendCommand(" ".join(sys.argv[1:])))
 
     # Start layman
-    daemon = layman.Layman()
+    from . import utils
+    if utils.useAsyncio():
+        from . import aio
+        daemon = aio.AsyncLayman()
+    else:
+        from . import layman
+        daemon = layman.Layman()
     daemon.init()
 
 if __name__ == '__main__':
@@ -0,0 +1,130 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import inspect
+import logging
+
+from i3ipc import Connection
+from i3ipc.aio import Connection as AsyncConnection
+
+from .connection import AsyncLaymanConnection, LaymanConnection
+from .layman import Layman
+from .server import MessageServer
+from . import config
+from . import tree
+
+
+class AsyncLayman(Layman):
+    """
+    Runs layman on an asyncio event loop. Sway events and commands from the
+    pipe are read on the loop and handled one at a time, in the order they
+    arrived. Layouts derived from AsyncWorkspaceLayoutManager are given an
+    AsyncLaymanConnection and awaited on the loop. Layman's own event routing
+    runs on a single thread so it can't stall the loop, and sync layouts run
+    unchanged on their workspace's worker.
+    """
+    asyncLayouts = True
+
+    def connectionFor(self, layout, worker):
+        return self.asyncCmdConn if layout.isAsync else worker.con
+
+
+    def runManager(self, handler, *args):
+        result = handler(*args)
+        if inspect.isawaitable(result):
+            # Called from the worker thread, wait for the handler on the loop
+            return asyncio.run_coroutine_threadsafe(result, self.loop).result()
+        return result
+
+
+    # The loop can't wait for space in the queue, it's what empties it
+    def putEvent(self, handler, event, key=None, seq=None):
+        self.intake.put(handler, event, key, block=False, seq=seq)
+        self.wakeup.set()
+
+
+    def onConfigFilesChanged(self, names):
+        self.loop.call_soon_threadsafe(self.putEvent, self.configFilesChanged, names)
+
+
+    def onManagerFailed(self, workspace):
+        self.loop.call_soon_threadsafe(self.putEvent, self.managerFailed, workspace)
+
+
+    async def dispatch(self):
+        while True:
+            item, wait = self.intake.pop()
+            if item is None:
+                # Sleep until something is queued, or the front event is ready
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.asyncCmdConn.update(item.event)
+            await self.loop.run_in_executor(self.executor, self.handleEvent, item)
+
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        # Get user config options
+        self.stopWorkers()
+        self.cmdConn = LaymanConnection(Connection())
+        self.asyncCmdConn = AsyncLaymanConnection(await AsyncConnection().connect())
+        self.loadOptions()
+        self.fetchLayouts()
+        if self.options.getDefault(config.KEY_TREE_MODEL):
+            interval = self.options.getDefault(config.KEY_TREE_MODEL_INTERVAL)
+            self.cmdConn.model = tree.TreeModel(self.cmdConn.con, interval)
+        self.startRecording()
+        self.startWatching()
+
+        # Set event callbacks, everything goes through the queue to keep order
+        self.server = MessageServer(self.onPipeCommand)
+        await self.server.startAsync()
+        self.intake = self.createQueue()
+        self.eventConn = await AsyncConnection().connect()
+        self.registerEvents(self.eventConn)
+
+        # Set default layout maangers for existing workspaces
+        if self.options.getDefault(config.KEY_LAYOUT):
+            await self.loop.run_in_executor(self.executor, self.arrangeWorkspaces)
+
+        # Start handling events
+        self.log("layman started with asyncio")
+        dispatcher = asyncio.ensure_future(self.dispatch())
+        try:
+            await self.eventConn.main()
+        finally:
+            dispatcher.cancel()
+            self.server.stop()
+
+
+    def init(self):
+        try:
+            asyncio.run(self.main())
+        except BaseException as e:
+            print("restarting after exception:")
+            logging.exception(e)
+            self.init()
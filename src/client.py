@@ -0,0 +1,76 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>. 
+"""
+# This module is run every time a command is sent from the command line, so
+# it only imports what it needs to talk to the daemon.
+from os import environ, getuid
+import socket
+import sys
+
+# The start of every reply to a command that succeeded. server.encodeReply
+# builds them from it, so they can be checked without importing json.
+REPLY_SUCCESS = b'{"success": true, "error": null, '
+
+
+# getSocketPath returns the path of the control socket, in the user's runtime
+# directory when there is one.
+def getSocketPath():
+    runtimeDir = environ.get("XDG_RUNTIME_DIR")
+    if runtimeDir:
+        return runtimeDir + "/layman.sock"
+    return "/tmp/layman-%d.sock" % getuid()
+
+
+# sendCommand sends a command to the daemon and waits for it to be handled.
+# It returns the exit status for the command line.
+def sendCommand(command):
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(getSocketPath())
+    except OSError:
+        print("layman is not running", file=sys.stderr)
+        return 1
+
+    try:
+        client.sendall((command.replace("\n", " ") + "\n").encode())
+        line = b""
+        while not line.endswith(b"\n"):
+            data = client.recv(4096)
+            if not data:
+                break
+            line += data
+    finally:
+        client.close()
+
+    if not line:
+        print("layman closed the connection", file=sys.stderr)
+        return 1
+
+    # Most replies only acknowledge the command, those don't need json
+    if line.startswith(REPLY_SUCCESS) and b'"result"' not in line:
+        return 0
+
+    import json
+    reply = json.loads(line)
+    if not reply["success"]:
+        print("layman: %s" % reply["error"], file=sys.stderr)
+        return 1
+    if isinstance(reply.get("result"), str):
+        print(reply["result"])
+    elif "result" in reply:
+        print(json.dumps(reply["result"], indent=4))
+    return 0
@@ -25,12 +25,29 @@ TABLE_LAYMAN = "layman"
 TABLE_WORKSPACE = "workspace"
 TABLE_OUTPUT = "output"
 KEY_DEBUG = "debug"
+KEY_LOG_LEVEL = "logLevel"
+KEY_LOG_BUFFER_SIZE = "logBufferSize"
 KEY_EXCLUDED_WORKSPACES = "excludeWorkspaces"
 KEY_EXCLUDED_OUTPUTS = "excludeOutputs"
 KEY_LAYOUT = "defaultLayout"
+KEY_FOCUS_DEBOUNCE = "focusDebounce"
+KEY_QUEUE_SIZE = "queueSize"
+KEY_TREE_MODEL = "treeModel"
+KEY_TREE_MODEL_INTERVAL = "treeModelInterval"
+KEY_WATCH_CONFIG = "watchConfig"
+
+# Marks options that haven't been resolved, since None is a resolved value
+MISSING = object()
 
 
 class LaymanConfig():
+    """
+    Reads the config file and resolves options for each workspace, from its
+    [workspace.NUM] table, then the [output.NAME] table of the output it's on,
+    then the [layman] table. Resolved values are kept until a workspace changes
+    output, and the output of each workspace is tracked from workspace and
+    output events, so lookups don't need to ask sway.
+    """
     def __init__(self, con, configPath):
         self.reloadConfig(con, configPath)
 
@@ -41,13 +58,36 @@ class LaymanConfig():
                 return tomli.load(f)
             except Exception as e:
                 exception(e)
-                return {}
+                return None
 
 
     def reloadConfig(self, con, configPath):
         self.configPath = configPath or CONFIG_PATH
         self.con = con
-        self.configDict = self.parse()
+        self.configDict = self.parse() or {}
+        self.refreshOutputs()
+
+
+    # update parses the config file again, and returns the options that
+    # changed for each of the given workspaces, as {num: {key: value}}. If
+    # the file can't be parsed, the current config is kept.
+    def update(self, workspaceNums):
+        configDict = self.parse()
+        if configDict is None:
+            return {}
+
+        previous = {num: self.resolveAll(num) for num in workspaceNums}
+        self.configDict = configDict
+        self.refreshOutputs()
+
+        changes = {}
+        for num in workspaceNums:
+            current = self.resolveAll(num)
+            changed = {key: current.get(key) for key in previous[num].keys() | current.keys()
+                       if previous[num].get(key) != current.get(key)}
+            if len(changed) > 0:
+                changes[num] = changed
+        return changes
 
 
     def getDefault(self, key):
@@ -58,25 +98,61 @@ class LaymanConfig():
 
 
     def getForWorkspace(self, workspaceNum, key):
-        # Try to get value for the workspace
-        try:
-            value = self.configDict[TABLE_WORKSPACE][str(workspaceNum)][key]
-        except KeyError:
-            # If workspace config doesn't have the key, try output
-            output = None
-            for workspace in self.con.get_workspaces():
-                if workspace.num == workspace.num:
-                    output = workspace.output
-            if output:
-                try:
-                    self.configDict[TABLE_OUTPUT][output][key]
-                except KeyError:
-                    pass
-
-            # If output config doesn't have the key, falback to default
-            try:
-                value = self.configDict[TABLE_LAYMAN][key]
-            except KeyError:
-                value = None
-
+        resolved = self.resolved
+        value = resolved.get((workspaceNum, key), MISSING)
+        if value is MISSING:
+            value = resolved[(workspaceNum, key)] = self.resolve(workspaceNum, key)
         return value
+
+
+    def resolve(self, workspaceNum, key):
+        tables = [
+            self.configDict.get(TABLE_WORKSPACE, {}).get(str(workspaceNum), {}),
+            self.configDict.get(TABLE_OUTPUT, {}).get(self.outputs.get(workspaceNum), {}),
+            self.configDict.get(TABLE_LAYMAN, {}),
+        ]
+        for table in tables:
+            if key in table:
+                return table[key]
+        return None
+
+
+    # resolveAll returns every option set for a workspace.
+    def resolveAll(self, workspaceNum):
+        keys = set(self.configDict.get(TABLE_LAYMAN, {}))
+        keys.update(self.configDict.get(TABLE_OUTPUT, {}).get(self.outputs.get(workspaceNum), {}))
+        keys.update(self.configDict.get(TABLE_WORKSPACE, {}).get(str(workspaceNum), {}))
+        return {key: self.getForWorkspace(workspaceNum, key) for key in keys}
+
+
+    """
+    Workspace outputs
+
+    The following functions keep track of which output each workspace is on,
+    and drop resolved values when that changes.
+    """
+
+    def refreshOutputs(self):
+        self.outputs = {workspace.num: workspace.output for workspace in self.con.get_workspaces()}
+        self.resolved = {}
+
+
+    # workspaceChanged is called for workspace events, with the workspace
+    # they're about.
+    def workspaceChanged(self, event):
+        workspace = event.current
+        if workspace is None:
+            return
+        if event.change == "empty":
+            self.outputs.pop(workspace.num, None)
+        elif self.outputs.get(workspace.num) != workspace.ipc_data.get("output"):
+            self.outputs[workspace.num] = workspace.ipc_data.get("output")
+        else:
+            return
+        self.resolved = {}
+
+
+    # outputChanged is called for output events. They don't say what changed,
+    # so every workspace's output is looked up again.
+    def outputChanged(self):
+        self.refreshOutputs()
@@ -0,0 +1,338 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+from contextlib import contextmanager, nullcontext
+from threading import Lock, local
+
+from i3ipc import CommandReply, Connection
+
+
+class LaymanConnection:
+    """
+    Wraps an i3ipc Connection so that everything handling a single event shares
+    one snapshot of the tree. The first get_tree() after update() fetches
+    the tree from sway, later calls reuse it until a command succeeds, since
+    that is the only way layman changes the tree.
+
+    If a TreeModel is set, lookups are served from the model instead, which is
+    updated from event payloads and only refetches the tree when it drifts.
+
+    Inside batch(), commands are queued and sent to sway as a single message
+    when the batch ends, or as soon as something needs to read sway's state.
+
+    Workers get a fork() of the connection events are routed with. Forks send
+    commands on a socket of their own, and tell their parent when they change
+    the tree. The model is only read or edited while holding the lock, commands
+    sent by forks are applied to it the next time it's used.
+    """
+    def __init__(self, con, model=None, parent=None):
+        self.con = con
+        self.model = model
+        self.parent = parent
+        self.tree = None
+        self.generation = 0
+        self.forkCommands = []
+        self.lock = Lock()
+        self.batches = local()
+        self.fetches = 0
+        self.commands = 0
+        self.messages = 0
+
+
+    def __getattr__(self, name):
+        # Anything not cached is passed straight to the real connection, once
+        # it can see the result of any queued commands
+        self.flush()
+        return getattr(self.con, name)
+
+
+    def get_tree(self):
+        self.flush()
+        if self.model is not None:
+            with self.lock:
+                self.applyForkCommands()
+                reconciles = self.model.reconciles
+                tree = self.model.get()
+                self.fetches += self.model.reconciles - reconciles
+            return tree
+        tree = self.tree
+        if tree is None:
+            # Don't keep the tree if a fork changed it while it was fetched
+            generation = self.generation
+            tree = self.con.get_tree()
+            self.fetches += 1
+            with self.lock:
+                if generation == self.generation:
+                    self.tree = tree
+        return tree
+
+
+    # snapshot returns the ipc data of the tree the last lookups were served
+    # from, or None if there isn't one. The model is changed in place, so it's
+    # copied, and reconciled first if an event left it dirty.
+    def snapshot(self):
+        if self.model is not None:
+            with self.lock:
+                self.applyForkCommands()
+                return self.model.data()
+        return self.tree.ipc_data if self.tree is not None else None
+
+
+    def command(self, payload):
+        if getattr(self.batches, "depth", 0) > 0:
+            reply = BatchedReply(self)
+            self.batches.pending.append((payload, reply))
+            return reply
+
+        result = self.con.command(payload)
+        self.commandSent(payload, result)
+        return result
+
+
+    def commandSent(self, payload, result):
+        self.commands += len(result)
+        self.messages += 1
+        if any(reply.success for reply in result):
+            if self.model is not None:
+                with self.lock:
+                    self.applyForkCommands()
+                    self.model.applyCommand(payload)
+            if self.parent is not None:
+                self.parent.forkChanged(payload)
+            self.invalidate()
+
+
+    # fork returns a connection with its own socket to sway, for use on
+    # another thread.
+    def fork(self):
+        return LaymanConnection(Connection(), parent=self)
+
+
+    # forkChanged is called from a fork's thread after it changes the tree.
+    # The command is kept for the model, which is only used by this thread.
+    def forkChanged(self, payload):
+        with self.lock:
+            self.generation += 1
+            if self.model is not None:
+                self.forkCommands.append(payload)
+            self.invalidate()
+
+
+    # applyForkCommands applies the commands forks sent since the model was
+    # last used, in the order they were sent. The lock must be held.
+    def applyForkCommands(self):
+        for payload in self.forkCommands:
+            self.model.applyCommand(payload)
+        self.forkCommands = []
+
+
+    # seed starts a fork's next task from its parent's snapshot, if no command
+    # has been sent since it was taken.
+    def seed(self, tree):
+        if tree is not None and tree is self.parent.tree:
+            self.tree = tree
+        else:
+            self.tree = None
+
+
+    # batch queues every command sent on this thread until the outermost
+    # batch exits, then sends them joined with ';'.
+    @contextmanager
+    def batch(self):
+        if getattr(self.batches, "depth", 0) == 0:
+            self.batches.depth = 0
+            self.batches.pending = []
+
+        self.batches.depth += 1
+        try:
+            yield self
+        finally:
+            self.batches.depth -= 1
+            if self.batches.depth == 0:
+                self.flush()
+
+
+    # flush sends any queued commands and hands each caller its own replies.
+    def flush(self):
+        pending = getattr(self.batches, "pending", None)
+        if not pending:
+            return
+
+        self.batches.pending = []
+        payload = "; ".join(x[0] for x in pending)
+        result = self.con.command(payload)
+        self.commandSent(payload, result)
+
+        for (_, reply), replies in zip(pending, splitReplies([x[0] for x in pending], result)):
+            reply.resolve(replies)
+
+
+    # counters returns the number of tree fetches, commands and command
+    # messages sent on this connection so far.
+    def counters(self):
+        return (self.fetches, self.commands, self.messages)
+
+
+    # update should be called when a new event or control command arrives,
+    # since sway may have changed the tree since the last one.
+    def update(self, event=None):
+        if self.model is not None:
+            with self.lock:
+                self.applyForkCommands()
+                self.model.applyEvent(event)
+        else:
+            self.invalidate()
+
+
+    # invalidate drops the current snapshot.
+    def invalidate(self):
+        self.tree = None
+
+
+class AsyncLaymanConnection:
+    """
+    The asyncio counterpart of LaymanConnection, wrapping an i3ipc.aio
+    Connection. Replies are read in the order requests are written, so a lock
+    keeps coroutines from interleaving messages on the command socket.
+    """
+    def __init__(self, con):
+        self.con = con
+        self.tree = None
+        self.lock = asyncio.Lock()
+        self.fetches = 0
+        self.commands = 0
+        self.messages = 0
+
+
+    def __getattr__(self, name):
+        return getattr(self.con, name)
+
+
+    async def get_tree(self):
+        async with self.lock:
+            if self.tree is None:
+                self.tree = await self.con.get_tree()
+                self.fetches += 1
+            return self.tree
+
+
+    async def command(self, payload):
+        return (await self.pipeline(payload))[0]
+
+
+    # pipeline sends commands that don't depend on each other's results in a
+    # single message, and returns the replies for each command in order.
+    async def pipeline(self, *payloads):
+        async with self.lock:
+            result = await self.con.command("; ".join(payloads))
+        self.commands += len(result)
+        self.messages += 1
+        if any(reply.success for reply in result):
+            self.invalidate()
+        return splitReplies(payloads, result)
+
+
+    # Async managers await each command, there is nothing to batch
+    def batch(self):
+        return nullcontext(self)
+
+
+    def counters(self):
+        return (self.fetches, self.commands, self.messages)
+
+
+    def update(self, event=None):
+        self.invalidate()
+
+
+    def invalidate(self):
+        self.tree = None
+
+
+class BatchedReply(list):
+    """
+    The reply to a command queued in a batch. It fills itself in with the
+    replies for that command once the batch is sent, and reading it before then
+    sends the batch early.
+    """
+    def __init__(self, con):
+        super().__init__()
+        self.con = con
+        self.resolved = False
+
+
+    def resolve(self, replies):
+        self.resolved = True
+        self.extend(replies)
+
+
+    def wait(self):
+        if not self.resolved:
+            self.con.flush()
+
+
+    def __getitem__(self, index):
+        self.wait()
+        return super().__getitem__(index)
+
+
+    def __iter__(self):
+        self.wait()
+        return super().__iter__()
+
+
+    def __len__(self):
+        self.wait()
+        return super().__len__()
+
+
+# splitReplies divides the replies to commands sent together in one message
+# into the replies for each command. Sway stops at the first invalid command,
+# so the commands after it get a failed reply.
+def splitReplies(payloads, result):
+    offset = 0
+    split = []
+    for payload in payloads:
+        count = countCommands(payload)
+        replies = result[offset:offset + count]
+        offset += count
+        while len(replies) < count:
+            replies.append(CommandReply({"success": False, "error": "Not run, an earlier command was invalid"}))
+        split.append(replies)
+    return split
+
+
+# countCommands returns the number of replies sway sends for a command string,
+# one for each command separated by ',' or ';' outside of criteria and quotes.
+def countCommands(payload):
+    count = 1
+    quote = None
+    criteria = False
+    for char in payload:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "[":
+            criteria = True
+        elif char == "]":
+            criteria = False
+        elif char in ",;" and not criteria:
+            count += 1
+    return count
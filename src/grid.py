@@ -0,0 +1,405 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+from collections import namedtuple
+import heapq
+
+from .tree import DRIFT_TOLERANCE
+
+# The heap is rebuilt once it holds this many more stale entries than leaves
+HEAP_SLACK = 16
+SPLIT_LAYOUTS = ("splith", "splitv")
+
+Rect = namedtuple("Rect", ["x", "y", "width", "height"])
+
+
+class GridNode:
+    """
+    A container in a GridIndex. Split containers sway created for a split
+    command have the id None until a window event shows their id.
+    """
+    def __init__(self, conId, layout, rect, parent=None):
+        self.id = conId
+        self.layout = layout
+        self.rect = rect
+        self.parent = parent
+        self.nodes = []
+        self.key = None
+
+
+class GridIndex:
+    """
+    A model of the tiling containers on a Grid workspace, with a heap of its
+    leaves ordered by size (width + height), then x, then y, so the window
+    Grid should split next is at the top. A second heap has them the other
+    way around, with the window Grid split last at the top. Rects are worked
+    out from the splits Grid makes, sharing each split container equally
+    between its children the way sway does, so adding or removing a window
+    only lays out the container it was in.
+
+    A leaf's old heap entries are left in place when it changes, and dropped
+    once they reach the top. The model is built from the tree when it's first
+    used, and cleared whenever a window's rect or parent doesn't match it,
+    since something other than Grid changed the layout. The windows Grid has
+    placed are remembered when it's cleared, so that windows still waiting to
+    be placed can be told apart from them.
+    """
+    def __init__(self):
+        self.windows = None
+        self.clear()
+
+
+    def clear(self):
+        self.root = None
+        self.byId = {}
+        self.heap = []
+        self.smallHeap = []
+
+
+    # build mirrors the tiling containers on a workspace, leaving out the
+    # windows in skipIds, and any split containers only they were in.
+    def build(self, workspace, skipIds=()):
+        self.clear()
+        changed = []
+        self.root = self.mirror(workspace, None, skipIds, changed)
+
+        # Containers the skipped windows were in are shared out again, as
+        # they will be once those windows are moved
+        for node in changed:
+            self.layout(node)
+        self.rebuildHeap()
+        self.windows = {node.id for node in self.byId.values() if len(node.nodes) == 0 and node is not self.root}
+
+
+    def mirror(self, con, parent, skipIds, changed):
+        node = GridNode(con.id, con.layout, rectOf(con), parent)
+        for child in con.nodes:
+            childNode = None if child.id in skipIds else self.mirror(child, node, skipIds, changed)
+            if childNode is not None:
+                node.nodes.append(childNode)
+        if parent is not None and len(con.nodes) > 0 and len(node.nodes) == 0:
+            return None
+        if len(node.nodes) < len(con.nodes):
+            changed.append(node)
+        self.byId[con.id] = node
+        return node
+
+
+    """
+    Queries
+    """
+
+    # largest returns the largest leaf that isn't in exclude. If no leaf is
+    # larger than `than`, it returns `than` instead. Ties go to the left-most,
+    # then top-most container.
+    def largest(self, than=None, exclude=()):
+        best = None
+        held = []
+        while len(self.heap) > 0:
+            node = self.leafFor(self.heap[0])
+            if node is None:
+                heapq.heappop(self.heap)
+            elif node.id in exclude:
+                held.append(heapq.heappop(self.heap))
+            else:
+                best = node
+                break
+
+        for entry in held:
+            heapq.heappush(self.heap, entry)
+        if best is None or (than is not None and best.key[:3] >= keyOf(than.rect)):
+            return than
+        return best
+
+
+    # smallest returns the smallest leaf accept returns True for, or None if
+    # there are none. Ties go to the right-most, then bottom-most container.
+    def smallest(self, accept=None):
+        best = None
+        held = []
+        while len(self.smallHeap) > 0:
+            node = self.leafFor(flipKey(self.smallHeap[0]))
+            if node is None:
+                heapq.heappop(self.smallHeap)
+            elif accept is not None and not accept(node):
+                held.append(heapq.heappop(self.smallHeap))
+            else:
+                best = node
+                break
+
+        for entry in held:
+            heapq.heappush(self.smallHeap, entry)
+        return best
+
+
+    # isPaired checks that a leaf shares a split container with one other
+    # leaf and nothing else, so moving it only grows that leaf. Containers
+    # with a single child, left by split commands, are looked through.
+    def isPaired(self, leaf):
+        slot = self.slotOf(leaf)
+        parent = slot.parent
+        if parent is None or parent.layout not in SPLIT_LAYOUTS or len(parent.nodes) != 2:
+            return False
+        other = parent.nodes[0] if parent.nodes[1] is slot else parent.nodes[1]
+        while len(other.nodes) == 1:
+            other = other.nodes[0]
+        return len(other.nodes) == 0
+
+
+    def slotOf(self, node):
+        while node.parent is not None and node.parent is not self.root and len(node.parent.nodes) == 1:
+            node = node.parent
+        return node
+
+
+    # parentOf returns the node for the container a new window was put in, or
+    # None if the model doesn't match the tree around it.
+    def parentOf(self, window):
+        if self.root is None or window.id in self.byId:
+            return None
+
+        con = window.parent
+        siblings = [child for child in con.nodes if child.id != window.id]
+        node = self.byId.get(con.id) or self.adopt(con, siblings)
+        if node is None or rectDrifted(node.rect, con.rect) or not self.matchNodes(node, siblings):
+            return None
+        node.layout = con.layout
+        return node
+
+
+    # placed checks whether a window has been placed in the model, even if
+    # it has been cleared since.
+    def placed(self, windowId):
+        return self.windows is not None and windowId in self.windows
+
+
+    # unknownLeaves returns the tiling windows on a workspace that haven't
+    # been placed, once the model has been built.
+    def unknownLeaves(self, workspace):
+        if self.windows is None:
+            return []
+        leaves = []
+        cons = list(workspace.nodes)
+        while len(cons) > 0:
+            con = cons.pop()
+            if len(con.nodes) == 0 and con.id not in self.windows:
+                leaves.append(con)
+            cons.extend(con.nodes)
+        return leaves
+
+
+    # matches checks that a window is where the model has it.
+    def matches(self, window):
+        if self.root is None:
+            return True
+
+        node = self.byId.get(window.id)
+        if node is None or rectDrifted(node.rect, window.rect):
+            return False
+        if node.parent.id is None and window.parent.id not in self.byId:
+            self.name(node.parent, window.parent.id)
+        return node.parent.id == window.parent.id
+
+
+    """
+    Changes
+
+    The following functions update the model for commands Grid sends.
+    """
+
+    # setSplit follows a split command on a leaf. Sway only changes the
+    # layout of a container with one child, otherwise the leaf is wrapped in
+    # a new container.
+    def setSplit(self, conId, layout):
+        node = self.byId.get(conId)
+        if node is None or node.parent is None:
+            return
+        parent = node.parent
+        if len(parent.nodes) == 1 and parent.layout in SPLIT_LAYOUTS:
+            parent.layout = layout
+            return
+
+        wrapper = GridNode(None, layout, node.rect, parent)
+        parent.nodes[parent.nodes.index(node)] = wrapper
+        wrapper.nodes.append(node)
+        node.parent = wrapper
+
+
+    # insert adds a window to a container at index, or after the leaf after.
+    def insert(self, windowId, parent, index=None, after=None):
+        if after is not None:
+            parent = after.parent
+            index = parent.nodes.index(after) + 1
+        node = GridNode(windowId, None, parent.rect, parent)
+        parent.nodes.insert(index, node)
+        self.byId[windowId] = node
+        self.windows.add(windowId)
+        self.layout(parent)
+
+
+    # remove takes a window out of the model, and returns whether it was in
+    # it.
+    def remove(self, windowId):
+        if self.windows is not None:
+            self.windows.discard(windowId)
+        node = self.byId.pop(windowId, None)
+        if node is None or node.parent is None:
+            return False
+
+        # Sway removes split containers left empty
+        parent = node.parent
+        parent.nodes.remove(node)
+        while parent is not self.root and len(parent.nodes) == 0:
+            self.byId.pop(parent.id, None)
+            parent.parent.nodes.remove(parent)
+            parent = parent.parent
+        self.layout(parent)
+        return True
+
+
+    """
+    Helpers
+    """
+
+    # layout shares a container's rect equally between its children, and
+    # scales the containers below them to fit. It updates the heap for any
+    # leaf that changed.
+    def layout(self, node, equal=True):
+        children = node.nodes
+        if len(children) == 0:
+            if node is not self.root:
+                self.setKey(node)
+            return
+
+        rect = node.rect
+        if node.layout in SPLIT_LAYOUTS:
+            horizontal = node.layout == "splith"
+            offset = rect.x if horizontal else rect.y
+            end = offset + (rect.width if horizontal else rect.height)
+            length = end - offset
+            if equal:
+                shares = [1] * len(children)
+            else:
+                shares = [child.rect.width if horizontal else child.rect.height for child in children]
+            total = sum(shares) or 1
+            for i, child in enumerate(children):
+                size = end - offset if i == len(children) - 1 else round(length * shares[i] / total)
+                if horizontal:
+                    child.rect = Rect(offset, rect.y, size, rect.height)
+                else:
+                    child.rect = Rect(rect.x, offset, rect.width, size)
+                offset += size
+        else:
+            # Tabbed and stacked children all share the container's rect
+            for child in children:
+                child.rect = rect
+
+        for child in children:
+            self.layout(child, False)
+
+
+    def setKey(self, leaf):
+        key = keyOf(leaf.rect) + (leaf.id,)
+        if key == leaf.key:
+            return
+        leaf.key = key
+        heapq.heappush(self.heap, key)
+        heapq.heappush(self.smallHeap, flipKey(key))
+        if max(len(self.heap), len(self.smallHeap)) > 2 * len(self.byId) + HEAP_SLACK:
+            self.rebuildHeap()
+
+
+    def rebuildHeap(self):
+        self.heap = []
+        for node in self.byId.values():
+            if len(node.nodes) == 0 and node is not self.root:
+                node.key = keyOf(node.rect) + (node.id,)
+                self.heap.append(node.key)
+        self.smallHeap = [flipKey(key) for key in self.heap]
+        heapq.heapify(self.heap)
+        heapq.heapify(self.smallHeap)
+
+
+    # leafFor returns the leaf a heap entry is for, or None if it's stale.
+    def leafFor(self, key):
+        node = self.byId.get(key[3])
+        if node is None or len(node.nodes) > 0 or node.key != key:
+            return None
+        return node
+
+
+    # adopt finds a container sway created for a split command, once a window
+    # is put in it next to the window that was split.
+    def adopt(self, con, siblings):
+        nodes = [self.byId.get(child.id) for child in siblings]
+        if len(nodes) == 0 or None in nodes:
+            return None
+        parent = nodes[0].parent
+        if parent is None or parent.id is not None or parent.nodes != nodes:
+            return None
+        self.name(parent, con.id)
+        return parent
+
+
+    # matchNodes checks that a node's children are the given containers, and
+    # names any split containers the model hasn't seen the id of yet.
+    def matchNodes(self, node, cons):
+        if len(node.nodes) != len(cons):
+            return False
+        for child, con in zip(node.nodes, cons):
+            if child.id is None and con.id in self.byId:
+                return False
+            if child.id is not None and child.id != con.id:
+                return False
+        for child, con in zip(node.nodes, cons):
+            if child.id is None:
+                self.name(child, con.id)
+        return True
+
+
+    def name(self, node, conId):
+        node.id = conId
+        self.byId[conId] = node
+
+
+def rectOf(con):
+    return Rect(con.rect.x, con.rect.y, con.rect.width, con.rect.height)
+
+
+# keyOf orders rects from largest to smallest, then left to right and top to
+# bottom.
+def keyOf(rect):
+    return (-sizeOf(rect), rect.x, rect.y)
+
+
+# flipKey turns a key around, so the smallest rect comes first, then the
+# right-most and bottom-most.
+def flipKey(key):
+    return (-key[0], -key[1], -key[2], key[3])
+
+
+# sizeOf is how Grid compares windows, the one with the longest sides is
+# split first.
+def sizeOf(rect):
+    return rect.width + rect.height
+
+
+def rectDrifted(rect, other):
+    return abs(rect.x - other.x) > DRIFT_TOLERANCE \
+        or abs(rect.y - other.y) > DRIFT_TOLERANCE \
+        or abs(rect.width - other.width) > DRIFT_TOLERANCE \
+        or abs(rect.height - other.height) > DRIFT_TOLERANCE
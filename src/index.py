@@ -0,0 +1,74 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+class WindowIndex:
+    """
+    Records which workspace each managed window is on, and the windows on each
+    workspace in the order they were added. Both directions are dicts, so
+    routing an event for a window doesn't need to search workspaces or fetch
+    the tree. The latest workspace container seen for each workspace is kept
+    too, for events that only carry a window.
+    """
+    def __init__(self):
+        self.workspaceNums = {}
+        self.windows = {}
+        self.workspaces = {}
+
+
+    def addWorkspace(self, workspace):
+        self.workspaces[workspace.num] = workspace
+        if workspace.num not in self.windows:
+            self.windows[workspace.num] = {}
+
+
+    # add records a window on a workspace, moving it from any other.
+    def add(self, windowId, workspace):
+        self.remove(windowId)
+        self.addWorkspace(workspace)
+        self.windows[workspace.num][windowId] = None
+        self.workspaceNums[windowId] = workspace.num
+
+
+    # remove forgets a window, and returns the number of the workspace it was
+    # on. If workspaceNum is given, it's only forgotten from that workspace.
+    def remove(self, windowId, workspaceNum=None):
+        num = self.workspaceNums.get(windowId)
+        if num is None or (workspaceNum is not None and num != workspaceNum):
+            return None
+        del self.workspaceNums[windowId]
+        del self.windows[num][windowId]
+        return num
+
+
+    def contains(self, workspaceNum, windowId):
+        return self.workspaceNums.get(windowId) == workspaceNum
+
+
+    def workspaceNum(self, windowId):
+        return self.workspaceNums.get(windowId)
+
+
+    # workspaceOf returns the last workspace container seen for the workspace
+    # a window is on, or None if the window isn't recorded.
+    def workspaceOf(self, windowId):
+        return self.workspaces.get(self.workspaceNums.get(windowId))
+
+
+    def windowsOn(self, workspaceNum):
+        return list(self.windows.get(workspaceNum, ()))
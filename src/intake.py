@@ -0,0 +1,144 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+from collections import deque
+from threading import Condition
+import time
+
+QUEUE_SIZE = 1024
+
+
+class QueuedEvent:
+    def __init__(self, handler, event, key, readyAt, seq):
+        self.handler = handler
+        self.event = event
+        self.key = key
+        self.seq = seq
+        self.readyAt = readyAt
+        self.receivedAt = time.monotonic()
+        self.dropped = False
+        self.superseded = 0
+
+
+class EventQueue:
+    """
+    Holds sway events and control commands between the threads that read them
+    and the one that handles them, in the order they arrived. Events put with
+    a key are held for `window` seconds, and dropped if another event with the
+    same key arrives in that time, so that a burst of focus changes on a
+    workspace is handled once.
+
+    Items can carry the sequence number they were recorded to a trace with.
+    The queue holds at most `size` items. Once it's full, put waits for space,
+    unless told not to block, which is counted in `overflowed`.
+    """
+    def __init__(self, window=0, size=QUEUE_SIZE):
+        self.window = window
+        self.size = size
+        self.items = deque()
+        self.pending = {}
+        self.condition = Condition()
+        self.closed = False
+        self.depth = 0
+        self.maxDepth = 0
+        self.queued = 0
+        self.handled = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.overflowed = 0
+
+
+    def put(self, handler, event, key=None, block=True, seq=None):
+        with self.condition:
+            if self.depth >= self.size:
+                if block:
+                    self.blocked += 1
+                    while self.depth >= self.size and not self.closed:
+                        self.condition.wait()
+                else:
+                    self.overflowed += 1
+
+            readyAt = time.monotonic() + self.window if key is not None else 0
+            item = QueuedEvent(handler, event, key, readyAt, seq)
+            if key is not None:
+                previous = self.pending.get(key)
+                if previous is not None:
+                    previous.dropped = True
+                    item.superseded = previous.superseded + 1
+                    self.dropped += 1
+                    self.depth -= 1
+                self.pending[key] = item
+            self.items.append(item)
+            self.queued += 1
+            self.depth += 1
+            self.maxDepth = max(self.maxDepth, self.depth)
+            self.condition.notify_all()
+
+
+    # pop returns the next event that is ready to be handled, or None and the
+    # number of seconds until the event at the front of the queue is ready.
+    def pop(self):
+        with self.condition:
+            while len(self.items) > 0 and self.items[0].dropped:
+                self.items.popleft()
+            if len(self.items) == 0:
+                return None, None
+
+            item = self.items[0]
+            wait = item.readyAt - time.monotonic()
+            if wait > 0:
+                return None, wait
+
+            self.items.popleft()
+            if item.key is not None and self.pending.get(item.key) is item:
+                del self.pending[item.key]
+            self.depth -= 1
+            self.handled += 1
+            self.condition.notify_all()
+            return item, None
+
+
+    # get blocks until an event is ready to be handled. It returns None once
+    # the queue is closed.
+    def get(self):
+        with self.condition:
+            while not self.closed:
+                item, wait = self.pop()
+                if item is not None:
+                    return item
+                self.condition.wait(wait)
+        return None
+
+
+    def stats(self):
+        with self.condition:
+            return {
+                "depth": self.depth,
+                "maxDepth": self.maxDepth,
+                "size": self.size,
+                "queued": self.queued,
+                "handled": self.handled,
+                "dropped": self.dropped,
+                "blocked": self.blocked,
+                "overflowed": self.overflowed,
+            }
+
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
@@ -16,18 +16,30 @@ A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License along with
 layman. If not, see <https://www.gnu.org/licenses/>. 
 """
+from concurrent.futures import Future
 from i3ipc import Event, Connection
 from importlib.machinery import SourceFileLoader
-import inspect
 import logging
 import os
 from setproctitle import setproctitle
 import shutil
+from threading import Lock, Thread
+import time
 
+from .connection import LaymanConnection
+from .index import WindowIndex
 from .server import MessageServer
+from .state import StateStore, getStatePath
+from .watcher import ConfigWatcher
+from .workers import WorkspaceWorker, chainFuture, gather
 
 from . import utils
 from . import config
+from . import intake
+from . import logger
+from . import stats
+from . import trace
+from . import tree
 from .managers import WorkspaceLayoutManager
 from .managers import MasterStackLayoutManager
 from .managers import AutotilingLayoutManager
@@ -35,10 +47,24 @@ from .managers import GridLayoutManager
 
 
 class Layman:
+    asyncLayouts = False # Can layouts derived from AsyncWorkspaceLayoutManager be used
+    debug = False
+    logLevel = logger.DEBUG
+
     def __init__(self):
         self.managers = utils.SimpleDict()
         self.userLayouts = utils.SimpleDict()
-        self.workspaceWindows = utils.SimpleDict()
+        self.windows = WindowIndex()
+        self.sizes = {}
+        self.workers = utils.SimpleDict()
+        self.bursts = {}
+        self.burstLock = Lock()
+        self.stats = stats.Stats()
+        self.states = StateStore(getStatePath())
+        self.receivedAt = time.monotonic()
+        self.recorder = None
+        self.watcher = None
+        self.server = None
         setproctitle("layman")
 
 
@@ -50,8 +76,16 @@ class Layman:
     """
 
     def windowCreated(self, _, event):
-        window = utils.findFocusedWindow(self.cmdConn)
-        workspace = utils.findFocusedWorkspace(self.cmdConn)
+        # Start each event with a fresh tree snapshot, shared by all lookups below
+        self.cmdConn.update(event)
+
+        # Several windows may have opened since the event was sent, so look up
+        # the one it's for rather than the focused one
+        window = self.cmdConn.get_tree().find_by_id(event.container.id)
+        workspace = window.workspace() if window is not None else None
+        if window is None or workspace is None:
+            window = utils.findFocusedWindow(self.cmdConn)
+            workspace = utils.findFocusedWorkspace(self.cmdConn)
 
         # Check if we should pass this call to a manager
         if self.isExcluded(workspace):
@@ -63,6 +97,7 @@ class Layman:
 
 
     def windowFocused(self, _, event):
+        self.cmdConn.update(event)
         window = utils.findFocusedWindow(self.cmdConn)
         workspace = utils.findFocusedWorkspace(self.cmdConn)
 
@@ -75,52 +110,51 @@ class Layman:
         self.dispatchToManager(event, window, workspace)
 
     def windowClosed(self, _, event):
-        # Try to find workspace by locating where the window is recorded
-        workspaces = []
-        for num in self.workspaceWindows:
-            if event.container.id in self.workspaceWindows[num]:
-                workspaces = self.cmdConn.get_tree().workspaces()
-                workspaces = [x for x in workspaces if x.num == num]
-                break
+        self.cmdConn.update(event)
+        # Find the workspace the window was recorded on
+        workspace = self.windows.workspaceOf(event.container.id)
 
         # Fallback to focused workspace if the window wasn't tracked
-        if workspaces == []:
+        if workspace is None:
             workspace = utils.findFocusedWorkspace(self.cmdConn)
-        else:
-            workspace = workspaces[0]
 
         if self.isExcluded(workspace):
             return
 
-        # Pass command to the appropriate manager
-        window = utils.findFocusedWindow(self.cmdConn)
-        self.dispatchToManager(event, window, workspace)
+        # Pass command to the appropriate manager, its worker looks up the
+        # window that was focused in place of the closed one
+        self.dispatchToManager(event, None, workspace)
 
 
     def windowMoved(self, _, event):
-        window = utils.findFocusedWindow(self.cmdConn)
-        workspace = utils.findFocusedWorkspace(self.cmdConn)
+        self.cmdConn.update(event)
+        # The event doesn't say where the window went, so it's found in the tree
+        window = self.cmdConn.get_tree().find_by_id(event.container.id)
+        workspace = window.workspace() if window is not None else None
+        if workspace is not None and workspace.name == "__i3_scratch":
+            # Moved to the scratchpad, which isn't managed
+            workspace = None
+        previous = self.windows.workspaceOf(event.container.id)
 
-        if self.isExcluded(workspace):
+        if previous is not None and workspace is not None and previous.num == workspace.num:
+            # Window moved within the same workspace, call windowMoved
+            if not self.isExcluded(workspace):
+                self.dispatchToManager(event, window, workspace)
             return
 
-        if window.id in self.workspaceWindows[workspace.num]:
-            # Window moved within the same workspace, call windowMoved
-            self.dispatchToManager(event, window, workspace)
-        else:
-            # Call windowAdded on new workspace
+        # Call windowRemoved on old workspace
+        if previous is not None and not self.isExcluded(previous):
+            event.change = "close"
+            self.dispatchToManager(event, window, previous)
+
+        # Call windowAdded on new workspace
+        if not self.isExcluded(workspace):
             event.change = "new"
             self.dispatchToManager(event, window, workspace)
 
-            # Find old workspace
-            for workspaceNum in self.workspaceWindows.keys():
-                if window.id in self.workspaceWindows[workspaceNum]:
-                    # Call windowRemoved on old workspace
-                    event.change = "close"
-                    self.dispatchToManager(event, window, workspace)
-
 
     def windowFloating(self, _, event):
+        self.cmdConn.update(event)
         window = self.cmdConn.get_tree().find_by_id(event.container.id)
         workspace = utils.findFocusedWorkspace(self.cmdConn)
 
@@ -154,7 +188,45 @@ class Layman:
     workspace::init and workspace::focus.
     """
 
+    def treeChanged(self, _, event):
+        # Keeps the tree model in sync with changes nothing else handles
+        if self.cmdConn.model is not None:
+            self.cmdConn.update(event)
+
+
+    def workspaceChanged(self, _, event):
+        self.options.workspaceChanged(event)
+        if event.change == "move":
+            # The workspace may be on an output with a different size now
+            self.cmdConn.update(event)
+            self.checkGeometry(event)
+        else:
+            self.treeChanged(_, event)
+
+
+    def outputChanged(self, _, event):
+        self.options.outputChanged()
+        self.cmdConn.update(event)
+        self.checkGeometry(event)
+
+
+    # checkGeometry calls workspaceResized for managers whose workspace has
+    # changed size since it was last checked.
+    def checkGeometry(self, event):
+        for workspace in self.cmdConn.get_tree().workspaces():
+            if workspace.num not in self.managers:
+                continue
+
+            size = (workspace.rect.width, workspace.rect.height)
+            if self.sizes.get(workspace.num, size) != size:
+                self.log("Workspace %d resized to %dx%d", workspace.num, *size)
+                self.submit(workspace, self.callResized, workspace, event, self.receivedAt)
+            self.sizes[workspace.num] = size
+
+
     def workspaceInit(self, _, event):
+        self.cmdConn.update(event)
+        self.options.workspaceChanged(event)
         if not self.isExcluded(event.current):
             self.setWorkspaceLayoutManager(event.current)
 
@@ -172,47 +244,98 @@ class Layman:
             command = command.replace("nop layman ", '').strip()
             self.onCommand(command)
 
+    # onCommand returns the futures of any work it queued on workers.
     def onCommand(self, command):
+        self.cmdConn.update()
+        futures = []
         for command in command.split(";"):
             command = command.strip()
             workspace = utils.findFocusedWorkspace(self.cmdConn)
             if not self.isExcluded(workspace):
-                self.handleCommand(workspace, command)
+                futures.append(self.handleCommand(workspace, command))
             else:
-                self.cmdConn.command(command)
+                self.sendCommand(self.cmdConn, command)
+        return futures
+
+
+    # controlCommand handles a command from the control socket. The future it
+    # returns finishes once every manager involved has handled it.
+    def controlCommand(self, command):
+        future = Future()
+        try:
+            report = self.getReport(command)
+            if report is not None:
+                future.set_result(report)
+                return future
+            return gather(self.onCommand(command))
+        except Exception as e:
+            future.set_exception(e)
+            return future
+
+
+    # getReport answers commands that ask about layman itself, rather than
+    # doing anything. It returns None for any other command.
+    def getReport(self, command):
+        if command == "queue":
+            return self.intake.stats()
+        if command == "log dump":
+            return logger.buffer.dump()
+        if command == "stats":
+            return self.stats.report()
+        if command == "stats reset":
+            self.stats.reset()
+            return "Reset stats"
+        return None
 
 
     def handleCommand(self, workspace, command):
-        # Handle movement commands
+        # Handle movement commands, after anything already queued for the workspace
         if "move" in command and not self.managers[workspace.num].overridesMoveBinds:
-            self.cmdConn.command(command)
-            self.log("Handling bind \"%s\" for workspace %d" % (command, workspace.num))
-            return
+            worker = self.workerFor(workspace)
+            self.log("Handling bind \"%s\" for workspace %d", command, workspace.num)
+            return self.submit(workspace, self.sendCommand, worker.con, command)
 
         # Handle reload command
         if command == "reload":
-            # Get user config options
-            self.options = config.LaymanConfig(self.cmdConn, utils.getConfigPath())
+            future = self.reloadOptions()
             self.fetchLayouts()
             self.log("Reloaded layman config")
-            return
+            return future
 
         # Handle wlm creation commands
         if "layout" in command:
             shortName = command.split(' ')[1]
             name = self.getLayoutNameByShortName(shortName)
-            layout = getattr(self.userLayouts[name], name)
-            self.managers[workspace.num] = layout(self.cmdConn, workspace, self.options)
-            self.log("Created %s on workspace %d" % (shortName, workspace.num))
+            if name is None:
+                raise ValueError("No layout named %s" % shortName)
+            self.createManager(workspace, name)
+            self.log("Created %s on workspace %d", shortName, workspace.num)
             return
 
         # Pass unknown command to the appropriate wlm
         if workspace.num not in self.managers:
-            self.log("No manager for workpsace %d, ignoring" % workspace.num)
+            self.log("No manager for workpsace %d, ignoring", workspace.num)
             return
             
-        self.log("Calling manager for workspace %d" % workspace.num)
-        self.managers[workspace.num].onBinding(command)
+        self.log("Calling manager for workspace %d", workspace.num)
+        return self.submit(workspace, self.callBinding, workspace, command, self.receivedAt)
+
+
+    # sendCommand passes a command on to sway, raising sway's error if it fails.
+    def sendCommand(self, con, command):
+        for reply in con.command(command):
+            if not reply.success:
+                raise RuntimeError(reply.error)
+
+
+    def callBinding(self, workspace, command, receivedAt):
+        manager = self.managers[workspace.num]
+        counters = manager.con.counters()
+        with manager.batch():
+            self.runManager(manager.onBinding, command)
+        self.saveState(manager)
+        self.stats.record("binding " + command, manager.shortName, time.monotonic() - receivedAt,
+                          stats.usageSince(manager.con, counters))
 
 
     """
@@ -223,31 +346,140 @@ class Layman:
     """
 
     def dispatchToManager(self, event, window, workspace):
+        # Windows are tracked here, since routing the next event depends on it
+        self.windows.addWorkspace(workspace)
+        if event.change == "new":
+            self.logCaller("Calling windowAdded for workspace %d", workspace.num)
+            self.windows.add(window.id, workspace)
+            self.addToBurst(event, window, workspace)
+            return
+        elif event.change == "focus":
+            self.logCaller("Calling windowFocused for workspace %d", workspace.num)
+        elif event.change == "move":
+            self.logCaller("Calling windowMoved for workspace %d", workspace.num)
+        elif event.change == "floating":
+            self.logCaller("Calling windowFloating for workspace %d", workspace.num)
+        elif event.change == "close":
+            self.logCaller("Calling windowRemoved for workspace %d", workspace.num)
+            if self.windows.remove(event.container.id, workspace.num) is None:
+                self.log("Window not tracked in workspace")
+
+        # The event may be changed and dispatched again before the worker gets
+        # to it, so pass the change along with it
+        args = (self.callManager, event.change, event, window, workspace, self.receivedAt)
+        if event.change == "focus" and self.inBurst(workspace, event.container.id):
+            # Sway focuses each window it adds, which doesn't end the burst
+            self.workerFor(workspace).submit(self.cmdConn.tree, *args)
+        else:
+            self.submit(workspace, *args)
+
+
+    # addToBurst queues a new window for its workspace's manager. Windows added
+    # while the worker hasn't started on the last one are handed to the
+    # manager together.
+    def addToBurst(self, event, window, workspace):
+        with self.burstLock:
+            burst = self.bursts.get(workspace.num)
+            if burst is not None:
+                burst.append((event, window, self.receivedAt))
+                return
+
+            burst = self.bursts[workspace.num] = [(event, window, self.receivedAt)]
+            self.workerFor(workspace).submit(self.cmdConn.tree, self.callBurst, burst, workspace)
+
+
+    # inBurst checks whether a window is waiting in its workspace's burst.
+    def inBurst(self, workspace, windowId):
+        with self.burstLock:
+            burst = self.bursts.get(workspace.num)
+            return burst is not None and any(window.id == windowId for _, window, _ in burst)
+
+
+    def callBurst(self, burst, workspace):
+        with self.burstLock:
+            if self.bursts.get(workspace.num) is burst:
+                del self.bursts[workspace.num]
+
+        if len(burst) == 1:
+            event, window, receivedAt = burst[0]
+            self.callManager("new", event, window, workspace, receivedAt)
+            return
+
         manager = self.managers[workspace.num]
+        counters = manager.con.counters()
+        tree = self.workers[workspace.num].con.get_tree()
+        windows = [tree.find_by_id(window.id) or window for _, window, _ in burst]
         try:
-            if event.change == "new":
-                self.logCaller("Calling windowAdded for workspace %d" % workspace.num)
-                self.workspaceWindows[workspace.num].append(window.id)
-                manager.windowAdded(event, window)
-            elif event.change == "focus":
-                self.logCaller("Calling windowFocused for workspace %d" % workspace.num)
-                manager.windowFocused(event, window)
-            elif event.change == "move":
-                self.logCaller("Calling windowMoved for workspace %d" % workspace.num)
-                manager.windowMoved(event, window)
-            elif event.change == "floating":
-                self.logCaller("Calling windowFloating for workspace %d" % workspace.num)
-                manager.windowFloating(event, window)
-            elif event.change == "close":
-                try:
-                    self.logCaller("Calling windowRemoved for workspace %d" % workspace.num)
-                    self.workspaceWindows[workspace.num].remove(window.id)
-                except:
-                    self.log("Window not tracked in workspace")
-                manager.windowRemoved(event, window)
+            with manager.batch():
+                self.runManager(manager.windowsAdded, [x[0] for x in burst], windows)
+            self.saveState(manager)
+
+            # The burst is timed for each window, its usage is only counted once
+            usage = stats.usageSince(manager.con, counters)
+            for _, _, receivedAt in burst:
+                self.stats.record("window::new", manager.shortName, time.monotonic() - receivedAt, usage)
+                usage = (0, 0, 0)
         except BaseException as e:
-            logging.exception(e)
-            self.setWorkspaceLayoutManager(workspace)
+            self.logException(e)
+            self.onManagerFailed(workspace)
+
+
+    def callResized(self, workspace, event, receivedAt):
+        manager = self.managers[workspace.num]
+        counters = manager.con.counters()
+        try:
+            with manager.batch():
+                self.runManager(manager.workspaceResized, event)
+            self.saveState(manager)
+            self.stats.record("workspace::resize", manager.shortName, time.monotonic() - receivedAt,
+                              stats.usageSince(manager.con, counters))
+        except BaseException as e:
+            self.logException(e)
+            self.onManagerFailed(workspace)
+
+
+    def callManager(self, change, event, window, workspace, receivedAt):
+        manager = self.managers[workspace.num]
+        counters = manager.con.counters()
+
+        # Earlier tasks on the worker may have moved the window since the
+        # event was routed, so look it up again
+        if window is not None and change != "close":
+            tree = self.workers[workspace.num].con.get_tree()
+            window = tree.find_by_id(window.id) or window
+        elif window is None:
+            window = self.workers[workspace.num].con.get_tree().find_focused()
+
+        try:
+            with manager.batch():
+                if change == "new":
+                    self.runManager(manager.windowAdded, event, window)
+                elif change == "focus":
+                    self.runManager(manager.windowFocused, event, window)
+                elif change == "move":
+                    self.runManager(manager.windowMoved, event, window)
+                elif change == "floating":
+                    self.runManager(manager.windowFloating, event, window)
+                elif change == "close":
+                    self.runManager(manager.windowRemoved, event, window)
+            self.saveState(manager)
+            self.stats.record("window::" + change, manager.shortName, time.monotonic() - receivedAt,
+                              stats.usageSince(manager.con, counters))
+        except BaseException as e:
+            self.logException(e)
+            self.onManagerFailed(workspace)
+
+
+    # onManagerFailed is called on a worker when its manager raised. The
+    # manager is replaced on the dispatcher, which owns the window index and
+    # workspace sizes. The worker doesn't wait for space in the queue, since
+    # the dispatcher may be waiting on the worker.
+    def onManagerFailed(self, workspace):
+        self.intake.put(self.managerFailed, workspace, block=False)
+
+
+    def managerFailed(self, _, workspace):
+        self.setWorkspaceLayoutManager(workspace)
 
 
     def fetchLayouts(self):
@@ -266,7 +498,7 @@ class Layman:
                 try:
                     module = SourceFileLoader(className, layoutPath + "/" + file).load_module()
                     self.userLayouts[className] = module
-                    self.log("Loaded user layout %s" % self.userLayouts[className].shortName)
+                    self.log("Loaded user layout %s", getattr(module, className).shortName)
                 except ImportError:
                     self.log("Layout not found: " + className)
 
@@ -277,15 +509,126 @@ class Layman:
                 return name
 
 
+    def createManager(self, workspace, name):
+        # Managers are created on their worker, after anything already queued
+        worker = self.workerFor(workspace)
+        worker.call(self.cmdConn.tree, self.buildManager, worker, workspace, self.getLayout(name))
+
+
+    def getLayout(self, name):
+        layout = getattr(self.userLayouts[name], name)
+        if layout.isAsync and not self.asyncLayouts:
+            self.log("Layout %s requires starting layman with --asyncio", layout.shortName)
+            layout = WorkspaceLayoutManager.WorkspaceLayoutManager
+        return layout
+
+
+    # buildManager creates a manager and lets it arrange the windows already
+    # on its workspace, with the commands sent in one batch. With restore,
+    # the manager is first given the state saved for the workspace, if any.
+    def buildManager(self, worker, workspace, layout, restore=False):
+        con = self.connectionFor(layout, worker)
+        with con.batch():
+            manager = layout(con, workspace, self.options)
+            state = self.states.get(workspace.num, manager.workspaceId, manager.shortName) if restore else None
+            if state is not None:
+                if self.restoreState(manager, state):
+                    self.log("Restored %s state for workspace %d", manager.shortName, workspace.num)
+                else:
+                    self.log("Saved state doesn't match workspace %d, arranging it again", workspace.num)
+            self.runManager(manager.arrange)
+            self.managers[workspace.num] = manager
+        self.saveState(manager)
+
+
+    # restoreState treats a state the manager can't read like one that
+    # doesn't match, since the file may be from another version of layman.
+    def restoreState(self, manager, state):
+        try:
+            return self.runManager(manager.restoreState, state)
+        except Exception as e:
+            self.logException(e)
+            return False
+
+
+    # saveState records a manager's state, so it can be restored if layman is
+    # restarted.
+    def saveState(self, manager):
+        try:
+            state = self.runManager(manager.saveState)
+            self.states.set(manager.workspaceNum, manager.workspaceId, manager.shortName, state)
+        except OSError as e:
+            self.log("Couldn't save state: %s", e)
+
+
+    # connectionFor returns the connection a layout's manager should be given.
+    def connectionFor(self, layout, worker):
+        return worker.con
+
+
+    # workerFor returns the worker that runs the manager for a workspace.
+    def workerFor(self, workspace):
+        if workspace.num not in self.workers:
+            self.workers[workspace.num] = WorkspaceWorker(workspace.num, self.cmdConn.fork())
+        return self.workers[workspace.num]
+
+
+    # submit queues a call on the worker for a workspace, it's handed the tree
+    # snapshot the event was routed with.
+    def submit(self, workspace, fn, *args):
+        # Anything queued after a burst of new windows ends it, so windows
+        # added later aren't handled before it
+        with self.burstLock:
+            self.bursts.pop(workspace.num, None)
+        return self.workerFor(workspace).submit(self.cmdConn.tree, fn, *args)
+
+
+    def stopWorkers(self):
+        for worker in self.workers.values():
+            worker.stop()
+        self.workers = utils.SimpleDict()
+        with self.burstLock:
+            self.bursts = {}
+
+
+    # runManager calls a manager's event or binding handler. It exists so that
+    # AsyncLayman can await handlers written as coroutines.
+    def runManager(self, handler, *args):
+        return handler(*args)
+
+
     def setWorkspaceLayoutManager(self, workspace):
 
         layoutName = self.options.getForWorkspace(workspace.num, config.KEY_LAYOUT)
         name = self.getLayoutNameByShortName(layoutName)
-        self.managers[workspace.num] = getattr(self.userLayouts[name], name)(self.cmdConn, workspace, self.options)
-        self.logCaller("Initialized workspace %d wth %s" % (workspace.num, self.managers[workspace.num].shortName))
-
-        if workspace.num not in self.workspaceWindows:
-            self.workspaceWindows[workspace.num] = []
+        self.createManager(workspace, name)
+        self.logCaller("Initialized workspace %d wth %s", workspace.num, self.managers[workspace.num].shortName)
+        self.trackWorkspace(workspace)
+
+
+    # arrangeWorkspaces sets managers for the workspaces that already exist.
+    # Every worker starts from the same tree snapshot, and they build their
+    # managers and arrange their workspaces in parallel. Managers that saved
+    # their state before layman was restarted only check it against the tree.
+    def arrangeWorkspaces(self):
+        workspaces = [x for x in self.cmdConn.get_workspaces() if not self.isExcluded(x)]
+        snapshot = self.cmdConn.get_tree()
+        futures = []
+        for workspace in workspaces:
+            layoutName = self.options.getForWorkspace(workspace.num, config.KEY_LAYOUT)
+            layout = self.getLayout(self.getLayoutNameByShortName(layoutName))
+            worker = self.workerFor(workspace)
+            futures.append(worker.submit(snapshot, self.buildManager, worker, workspace, layout, True))
+
+        for workspace, future in zip(workspaces, futures):
+            future.result()
+            self.log("Initialized workspace %d wth %s", workspace.num, self.managers[workspace.num].shortName)
+            self.trackWorkspace(workspace)
+
+
+    def trackWorkspace(self, workspace):
+        self.windows.addWorkspace(workspace)
+        self.sizes[workspace.num] = (workspace.rect.width, workspace.rect.height)
 
     
     def createConfig(self):
@@ -294,18 +637,199 @@ class Layman:
             if os.path.exists(os.path.dirname(configPath)):
                 shutil.copyfile(os.path.join(os.path.dirname(__file__), 'config.toml'), configPath)            
             else:
-                self.logCaller("Path to user config does not exts: %s" % configPath)
+                self.logCaller("Path to user config does not exts: %s", configPath)
                 exit()
 
 
-    def log(self, msg):
-        if self.options.getDefault(config.KEY_DEBUG):
-            print("%s: %s" % (inspect.stack()[1][3], msg))
+    # log records a message from the function that called it, msg is only
+    # formatted with args if it's printed or dumped.
+    def log(self, msg, *args):
+        logger.record(logger.DEBUG, self.logLevel, self.debug, "layman", 1, msg, args)
+
 
+    # logCaller records a message from the function 2 calls up.
+    def logCaller(self, msg, *args):
+        logger.record(logger.DEBUG, self.logLevel, self.debug, "layman", 2, msg, args)
 
-    def logCaller(self, msg):
-        if self.options.getDefault(config.KEY_DEBUG):
-            print("%s: %s" % (inspect.stack()[2][3], msg))
+
+    def logException(self, e):
+        logging.exception(e)
+        logger.record(logger.ERROR, self.logLevel, False, "layman", 1, "%s: %s", (type(e).__name__, e))
+
+
+    def loadOptions(self):
+        self.options = config.LaymanConfig(self.cmdConn, utils.getConfigPath())
+        self.applyOptions()
+
+
+    def applyOptions(self):
+        self.debug = self.options.getDefault(config.KEY_DEBUG)
+        self.logLevel = logger.getLevel(self.options.getDefault(config.KEY_LOG_LEVEL))
+        logger.buffer.resize(self.options.getDefault(config.KEY_LOG_BUFFER_SIZE) or logger.BUFFER_SIZE)
+
+
+    # reloadOptions reads the config file again, and passes the options that
+    # changed for each workspace to its manager, rather than recreating it.
+    # The future it returns finishes once every manager has been told.
+    def reloadOptions(self):
+        changed = self.options.update(list(self.managers))
+        self.applyOptions()
+        futures = []
+        for num, changes in changed.items():
+            self.log("Options changed on workspace %d: %s", num, ", ".join(sorted(changes)))
+            futures.append(self.workers[num].submit(self.cmdConn.tree, self.callOptionsChanged, num, changes))
+        return gather(futures)
+
+
+    def callOptionsChanged(self, num, changes):
+        manager = self.managers[num]
+        with manager.con.batch():
+            self.runManager(manager.optionsChanged, changes)
+        self.saveState(manager)
+
+
+    """
+    Config watching
+
+    When watchConfig is enabled, changes to the config file and user layouts
+    are picked up without needing `layman reload`.
+    """
+
+    def startWatching(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        if self.options.getDefault(config.KEY_WATCH_CONFIG) is False:
+            return
+
+        watcher = ConfigWatcher(os.path.dirname(utils.getConfigPath()), self.onConfigFilesChanged)
+        try:
+            watcher.start()
+            self.watcher = watcher
+        except OSError as e:
+            self.log("Not watching config for changes: %s", e)
+
+
+    # onConfigFilesChanged is called from the watcher's thread, changes are
+    # handled in order with events like any other reload.
+    def onConfigFilesChanged(self, names):
+        self.putEvent(self.configFilesChanged, names)
+
+
+    def configFilesChanged(self, _, names):
+        if os.path.basename(utils.getConfigPath()) in names:
+            self.reloadOptions()
+            self.log("Reloaded changed config")
+        if any(name.endswith(".py") for name in names):
+            self.fetchLayouts()
+
+
+    """
+    Event intake
+
+    Sway events and commands from the control socket are queued as they arrive
+    and handled in order by dispatch, one at a time. This keeps routing on a
+    single thread, and lets bursts of focus events on a workspace be merged.
+    """
+
+    def registerEvents(self, con):
+        con.on(Event.BINDING, self.enqueue(self.onBinding))
+        con.on(Event.WINDOW_FOCUS, self.enqueueFocus)
+        con.on(Event.WINDOW_NEW, self.enqueue(self.windowCreated))
+        con.on(Event.WINDOW_CLOSE, self.enqueue(self.windowClosed))
+        con.on(Event.WINDOW_MOVE, self.enqueue(self.windowMoved))
+        con.on(Event.WINDOW_FLOATING, self.enqueue(self.windowFloating))
+        con.on(Event.WORKSPACE_INIT, self.enqueue(self.workspaceInit))
+        con.on(Event.WORKSPACE_EMPTY, self.enqueue(self.workspaceChanged))
+        con.on(Event.WORKSPACE_FOCUS, self.enqueue(self.workspaceChanged))
+        con.on(Event.WORKSPACE_MOVE, self.enqueue(self.workspaceChanged))
+        con.on(Event.WORKSPACE_RENAME, self.enqueue(self.workspaceChanged))
+        con.on(Event.OUTPUT, self.enqueue(self.outputChanged))
+
+
+    def enqueue(self, handler):
+        def put(_, event):
+            seq = self.recorder.recordEvent(event) if self.recorder is not None else None
+            self.putEvent(handler, event, seq=seq)
+        return put
+
+
+    def enqueueFocus(self, _, event):
+        seq = self.recorder.recordEvent(event) if self.recorder is not None else None
+
+        # Only the latest focus on each workspace needs handling. Windows the
+        # index doesn't track, like ones open before layman started, aren't
+        # merged, since their workspace isn't known here.
+        num = self.windows.workspaceNum(event.container.id)
+        key = ("focus", num) if num is not None else None
+        self.putEvent(self.windowFocused, event, key, seq)
+
+
+    def putEvent(self, handler, event, key=None, seq=None):
+        self.intake.put(handler, event, key, seq=seq)
+
+
+    # onPipeCommand queues a command from the control socket behind any events
+    # already waiting, the future it returns finishes once it's been handled.
+    def onPipeCommand(self, command):
+        future = Future()
+        if self.recorder is not None:
+            self.recorder.recordCommand(command)
+        self.putEvent(self.runCommand, (command, future))
+        return future
+
+
+    def runCommand(self, _, request):
+        command, future = request
+        self.controlCommand(command).add_done_callback(lambda x: chainFuture(x, future))
+
+
+    def createQueue(self):
+        debounce = self.options.getDefault(config.KEY_FOCUS_DEBOUNCE) or 0
+        size = self.options.getDefault(config.KEY_QUEUE_SIZE) or intake.QUEUE_SIZE
+        return intake.EventQueue(debounce / 1000, size)
+
+
+    def dispatch(self):
+        while True:
+            item = self.intake.get()
+            if item is None:
+                return
+            self.handleEvent(item)
+
+
+    def handleEvent(self, item):
+        if item.superseded:
+            self.log("Dropped %d superseded events, %d in total", item.superseded, self.intake.dropped)
+
+        # Work queued on workers is timed from when the event was received
+        self.receivedAt = item.receivedAt
+        counters = self.cmdConn.counters()
+        try:
+            item.handler(None, item.event)
+        except Exception as e:
+            self.logException(e)
+        self.stats.record(item.handler.__name__, "layman", time.monotonic() - item.receivedAt,
+                          stats.usageSince(self.cmdConn, counters))
+        if self.recorder is not None:
+            self.recorder.recordTree(item.seq, self.cmdConn.snapshot())
+
+
+    # startRecording opens the trace file given with --record, once, so a
+    # restart after an exception keeps adding to the same trace.
+    def startRecording(self):
+        path = utils.getRecordPath()
+        if path is None or self.recorder is not None:
+            return
+
+        configPath = utils.getConfigPath()
+        configText = None
+        if os.path.exists(configPath):
+            with open(configPath) as f:
+                configText = f.read()
+        self.cmdConn.get_tree()
+        self.recorder = trace.TraceRecorder(path, configText, self.cmdConn.snapshot())
+        self.log("Recording trace to %s", path)
 
 
     def isExcluded(self, workspace):
@@ -323,34 +847,39 @@ class Layman:
 
     def init(self):
         # Get user config options
-        self.cmdConn = Connection()
-        self.options = config.LaymanConfig(self.cmdConn, utils.getConfigPath())
+        self.stopWorkers()
+        self.cmdConn = LaymanConnection(Connection())
+        self.loadOptions()
         self.fetchLayouts()
+        if self.options.getDefault(config.KEY_TREE_MODEL):
+            interval = self.options.getDefault(config.KEY_TREE_MODEL_INTERVAL)
+            self.cmdConn.model = tree.TreeModel(self.cmdConn.con, interval)
+        self.startRecording()
+        self.startWatching()
 
         # Set event callbacks
-        self.server = MessageServer(self.onCommand)
+        self.intake = self.createQueue()
+        if self.server is not None:
+            # Left over from before a restart
+            self.server.stop()
+        self.server = MessageServer(self.onPipeCommand)
+        self.server.start()
         self.eventConn = Connection()
-        self.eventConn.on(Event.BINDING, self.onBinding)
-        self.eventConn.on(Event.WINDOW_FOCUS, self.windowFocused)
-        self.eventConn.on(Event.WINDOW_NEW, self.windowCreated)
-        self.eventConn.on(Event.WINDOW_CLOSE, self.windowClosed)
-        self.eventConn.on(Event.WINDOW_MOVE, self.windowMoved)
-        self.eventConn.on(Event.WINDOW_FLOATING, self.windowFloating)
-        self.eventConn.on(Event.WORKSPACE_INIT, self.workspaceInit)
+        self.registerEvents(self.eventConn)
 
       # Set default layout maangers for existing workspaces
         if self.options.getDefault(config.KEY_LAYOUT):
-            for workspace in self.cmdConn.get_workspaces():
-                if not self.isExcluded(workspace):
-                    self.setWorkspaceLayoutManager(workspace)
-                    self.workspaceWindows[workspace.num] = []
+            self.arrangeWorkspaces()
 
         # Start handling events
         self.log("layman started")
+        dispatcher = Thread(target=self.dispatch, daemon=True)
+        dispatcher.start()
         try:
             self.eventConn.main()
         except BaseException as e:
             print("restarting after exception:")
             logging.exception(e)
             self.eventConn.main_quit()
+            self.intake.close()
             self.init()
@@ -0,0 +1,88 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>. 
+"""
+from collections import deque
+import sys
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR, "none": 100}
+BUFFER_SIZE = 1000
+
+
+class LogBuffer:
+    """
+    Keeps the most recent log records in memory, so they can be read back with
+    `layman log dump` without debug output being printed all the time. Records
+    are stored with their format string and arguments, and only formatted when
+    they're dumped.
+    """
+    def __init__(self, size=BUFFER_SIZE):
+        self.records = deque(maxlen=size)
+
+
+    def resize(self, size):
+        if size != self.records.maxlen:
+            self.records = deque(self.records, maxlen=size)
+
+
+    def add(self, level, source, caller, msg, args):
+        self.records.append((time.time(), level, source, caller, msg, args))
+
+
+    def dump(self):
+        names = {value: name for name, value in LEVELS.items()}
+        lines = []
+        for created, level, source, caller, msg, args in list(self.records):
+            stamp = time.strftime("%H:%M:%S", time.localtime(created)) + ".%03d" % (created % 1 * 1000)
+            lines.append("%s %-7s %s: %s: %s" % (stamp, names.get(level, level), source, caller, formatMessage(msg, args)))
+        return "\n".join(lines)
+
+
+# Records from layman and every manager go to the same buffer
+buffer = LogBuffer()
+
+
+# getLevel returns the level for a name from the config, defaulting to debug.
+def getLevel(name):
+    return LEVELS.get(str(name).lower(), DEBUG) if name is not None else DEBUG
+
+
+# getCaller returns the name of the function `depth` calls above the one
+# calling getCaller. Unlike inspect.stack(), it doesn't read any source files.
+def getCaller(depth):
+    return sys._getframe(depth + 1).f_code.co_name
+
+
+def formatMessage(msg, args):
+    return msg % args if args else msg
+
+
+# record adds a message to the buffer if it's at least bufferLevel, and prints
+# it if printing is enabled. The message is only formatted if it's printed.
+def record(level, bufferLevel, printing, source, depth, msg, args):
+    if level < bufferLevel and not printing:
+        return
+
+    caller = getCaller(depth + 1)
+    if level >= bufferLevel:
+        buffer.add(level, source, caller, msg, args)
+    if printing:
+        print("%s: %s: %s" % (source, caller, formatMessage(msg, args)))
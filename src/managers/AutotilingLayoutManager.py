@@ -27,6 +27,14 @@ class AutotilingLayoutManager(WorkspaceLayoutManager):
     def __init__(self, con, workspace, options):
         super().__init__(con, workspace, options)
         self.depthLimit = options.getForWorkspace(self.workspaceNum, KEY_DEPTH_LIMIT) or 0
+        # Container id to its parent's id and depth, when depthLimit is set
+        self.depths = {}
+
+    def optionsChanged(self, changes):
+        super().optionsChanged(changes)
+        if KEY_DEPTH_LIMIT in changes:
+            self.depthLimit = changes[KEY_DEPTH_LIMIT] or 0
+            self.depths = {}
 
     def isExcluded(self, window):
         if window is None:
@@ -52,43 +60,92 @@ class AutotilingLayoutManager(WorkspaceLayoutManager):
 
         return False
 
-    def switchSplit(self, window):
+    # splitFor returns the split a window should have, or None if it's
+    # excluded, past depthLimit, or already split that way.
+    def splitFor(self, window):
         if self.isExcluded(window):
-            return
+            return None
 
         # Check if we've hit the depth limit before splitting
-        if self.depthLimit:
-            windowParent = window
-            depth = 0
-            while depth <= self.depthLimit:
-                if windowParent.type != "workspace":
-                    # Exit when depth limit is reached
-                    if depth == self.depthLimit:
-                        return
-
-                    windowParent = windowParent.parent
-
-                    # Only count depth of containers with more than 1 child
-                    if len(windowParent.nodes) > 1:
-                        depth += 1
-                else:
-                    # Top of workspace reached, continue to split
-                    break
+        if self.depthLimit and self.depthOf(window) >= self.depthLimit:
+            return None
 
         newLayout = "splitv" if window.rect.height > window.rect.width else "splith"
-        if newLayout != window.parent.layout:
-            result = self.con.command(newLayout)
+        if newLayout == window.parent.layout:
+            return None
+        return newLayout
+
+    # depthOf returns the number of containers above a window with more than
+    # one child, not counting the workspace. Depths are cached, and only
+    # looked up again from the first container up whose parent changed.
+    def depthOf(self, window):
+        chain = []
+        node = window
+        depth = 0
+        while node.parent.type != "workspace":
+            entry = self.depths.get(node.id)
+            if entry is not None and entry[0] == node.parent.id:
+                depth = entry[1]
+                break
+            chain.append(node)
+            node = node.parent
+        else:
+            self.depths[node.id] = (node.parent.id, 0)
+
+        for node in reversed(chain):
+            if len(node.parent.nodes) > 1:
+                depth += 1
+            self.depths[node.id] = (node.parent.id, depth)
+        return depth
+
+    # Adding a container to another changes the depth of everything under
+    # that one, unless it's the workspace, which isn't counted.
+    def forgetAdded(self, window):
+        if window.parent.type == "workspace":
+            self.depths.pop(window.id, None)
+            self.forgetUnder(window)
+        else:
+            self.forgetUnder(window.parent)
+
+    # Removing a container changes the depth of everything under its old
+    # parent, or under the closest ancestor left if the parent was removed
+    # with it.
+    def forgetRemoved(self, conId):
+        entry = self.depths.pop(conId, None)
+        while entry is not None:
+            parent = self.getConById(entry[0])
+            if parent is not None:
+                if parent.type != "workspace":
+                    self.forgetUnder(parent)
+                return
+            entry = self.depths.pop(entry[0], None)
+
+        # The old parent isn't known
+        self.depths = {}
+
+    def forgetUnder(self, con):
+        for node in con.descendants():
+            self.depths.pop(node.id, None)
+
+    def switchSplit(self, window):
+        newLayout = self.splitFor(window)
+        if newLayout is not None:
+            result = self.con.command("[con_id=%d] %s" % (window.id, newLayout))
             if result[0].success:
-                self.log("Switched to %s" % newLayout)
+                self.log("Switched to %s", newLayout)
             elif self.debug:
                 self.log("Error: Switch failed with err {}".format(result[0].error))
 
 
     def windowAdded(self, event, window):
+        if self.depthLimit and not self.isExcluded(window):
+            self.forgetAdded(window)
         self.switchSplit(window)
 
 
     def windowRemoved(self, event, window):
+        if self.depthLimit:
+            self.forgetRemoved(event.container.id)
         self.switchSplit(window)
 
 
@@ -97,4 +154,29 @@ class AutotilingLayoutManager(WorkspaceLayoutManager):
 
 
     def windowMoved(self, event, window):
+        if self.depthLimit:
+            if window.parent.type == "workspace":
+                # Moving a window out to the workspace can wrap everything
+                # else on it in a new container
+                self.depths = {}
+            else:
+                self.forgetRemoved(window.id)
+                self.forgetAdded(window)
         self.switchSplit(window)
+
+
+    # Every window changes shape with the workspace, so all of them are
+    # checked against one snapshot of the tree, and only the splits that
+    # changed are sent, in one message.
+    def workspaceResized(self, event):
+        workspace = self.getWorkspaceCon()
+        if workspace is None:
+            return
+
+        switched = 0
+        for window in workspace.leaves():
+            newLayout = self.splitFor(window)
+            if newLayout is not None:
+                self.con.command("[con_id=%d] %s" % (window.id, newLayout))
+                switched += 1
+        self.log("Switched %d splits", switched)
@@ -17,6 +17,13 @@ You should have received a copy of the GNU General Public License along with
 layman. If not, see <https://www.gnu.org/licenses/>. 
 """
 from .WorkspaceLayoutManager import WorkspaceLayoutManager
+from ..grid import GridIndex, sizeOf
+
+# A grid is rebalanced once its largest window is more than this many times
+# the size of its smallest, by the same width + height Grid picks the largest
+# window by. Grid splits the longer side, so a split takes at most a third off
+# a window's size, and windows in a balanced grid differ by one split.
+BALANCE_RATIO = 1.5
 
 
 class GridLayoutManager(WorkspaceLayoutManager):
@@ -24,6 +31,7 @@ class GridLayoutManager(WorkspaceLayoutManager):
 
     def __init__(self, con, workspace, options):
         super().__init__(con, workspace, options)
+        self.index = GridIndex()
 
     def isExcluded(self, window):
         if window is None:
@@ -53,48 +61,144 @@ class GridLayoutManager(WorkspaceLayoutManager):
     def switchSplit(self, window):
         newLayout = "splitv" if window.rect.height > window.rect.width else "splith"
         result = self.con.command(("[con_id=%d]" % window.id) + newLayout)
-        if result[0].success:
-            self.log("Switched to %s" % newLayout)
-        elif self.debug:
+        self.index.setSplit(window.id, newLayout)
+
+        # Reading the reply sends the commands batched so far, so it's only
+        # checked when debugging
+        if not self.debug:
+            self.log("Queued switch to %s", newLayout)
+        elif result[0].success:
+            self.log("Switched to %s", newLayout)
+        else:
             self.log("Error: Switch failed with err {}".format(result[0].error))
 
 
     def windowAdded(self, event, window):
-        if self.isExcluded(window):
+        self.windowsAdded([event], [window])
+
+
+    # When windows are added faster than they're handled, sway has already
+    # put them all in the tree. Any the model hasn't placed yet are placed
+    # together in one pass, each splitting the largest window once the ones
+    # before it are placed, and the commands are sent in one message when the
+    # handler returns.
+    def windowsAdded(self, events, windows):
+        windows = [window for window in windows if not self.isExcluded(window)]
+
+        # Windows placed with an earlier burst only need checking
+        for window in windows:
+            if self.index.placed(window.id) and not self.index.matches(window):
+                self.index.clear()
+        windows = [window for window in windows if not self.index.placed(window.id)]
+        if len(windows) == 0:
             return
 
-        # Find largest container
-        leaves = self.getWorkspaceCon().leaves()
-        largestCon = window.parent
-        conSize = window.parent.rect.height + window.parent.rect.width
-        for leaf in leaves:
-            if leaf.parent.id == window.parent.id:
-                continue
-
-            if (leaf.rect.height + leaf.rect.width) > conSize:
-                # Split the largest container
-                largestCon = leaf
-                conSize = leaf.rect.height + leaf.rect.width
-            elif largestCon is not None and (leaf.rect.height + leaf.rect.width) == conSize:
-                # If multiple containers are the largest, select left most first and top most second
-                moreLeft = leaf.rect.x < largestCon.rect.x
-                sameLeftHigher = leaf.rect.x == largestCon.rect.x and leaf.rect.y < largestCon.rect.y
-                if moreLeft or sameLeftHigher:
-                    largestCon = leaf
-                    conSize = leaf.rect.height + leaf.rect.width
+        # A single window is placed from the model, which is only built from
+        # the tree when it doesn't match
+        if len(windows) == 1:
+            parent = self.index.parentOf(windows[0])
+            if parent is not None:
+                self.splitLargest(windows[0], parent)
+                return
+
+        workspace = self.getWorkspaceCon()
+        windows = self.findUnplaced(workspace, windows)
+        self.index.build(workspace, {window.id for window in windows})
+        if len(windows) == 1:
+            parent = self.index.parentOf(windows[0])
+            if parent is not None:
+                self.splitLargest(windows[0], parent)
+                return
+
+        for window in windows:
+            largestCon = self.index.largest()
+            if largestCon is None:
+                # Nothing to split yet, the first window stays where it is
+                parent = self.index.byId.get(window.parent.id) or self.index.root
+                self.index.insert(window.id, parent, len(parent.nodes))
+            else:
+                self.switchSplit(largestCon)
+                self.moveWindow(window.id, largestCon.id)
+                self.index.insert(window.id, None, after=largestCon)
+            self.switchSplit(self.index.byId[window.id])
+
+
+    # splitLargest places a window that was put in parent.
+    def splitLargest(self, window, parent):
+        # Find largest container, other than the window's siblings
+        largestCon = self.index.largest(parent, {node.id for node in parent.nodes})
 
         # Split largest container, move new window to it
-        if largestCon is not None and largestCon.id != window.parent.id:
+        if largestCon is not parent:
             self.switchSplit(largestCon)
             self.moveWindow(window.id, largestCon.id)
+            self.index.insert(window.id, None, after=largestCon)
+        else:
+            self.index.insert(window.id, parent, [node.id for node in window.parent.nodes].index(window.id))
 
         self.switchSplit(window)
 
 
+    # findUnplaced returns the given windows and any others on the workspace
+    # the model hasn't placed, in the order they were created.
+    def findUnplaced(self, workspace, windows):
+        found = {window.id: window for window in windows}
+        for leaf in self.index.unknownLeaves(workspace):
+            if not self.isExcluded(leaf):
+                found.setdefault(leaf.id, leaf)
+        return sorted(found.values(), key=lambda x: x.id)
+
+
+    def windowRemoved(self, event, window):
+        if self.index.root is None:
+            # Windows still waiting to be placed are left out, so they are
+            # placed when their events are handled
+            workspace = self.getWorkspaceCon()
+            self.index.remove(event.container.id)
+            self.index.build(workspace, {window.id for window in self.findUnplaced(workspace, [])})
+        elif not self.index.remove(event.container.id):
+            return
+        self.rebalance()
+
+
+    # The windows that shared a container with a removed window grow into its
+    # space. While the largest window is too large, the smallest window that
+    # shares a split with one other is moved to split it, which puts all
+    # three back to the size of windows around them. Only windows that grew
+    # can be too large, so the moves are bounded by them, and sent in one
+    # message when the handler returns.
+    def rebalance(self):
+        for _ in range(len(self.index.byId)):
+            largestCon = self.index.largest()
+            smallestCon = self.index.smallest()
+            if largestCon is None or sizeOf(largestCon.rect) <= BALANCE_RATIO * sizeOf(smallestCon.rect):
+                return
+
+            # The window left in the split grows to fill it, which only helps
+            # if it ends up smaller than the largest window
+            limit = sizeOf(largestCon.rect)
+            smallestCon = self.index.smallest(lambda x: self.index.isPaired(x)
+                                              and sizeOf(self.index.slotOf(x).parent.rect) < limit)
+            if smallestCon is None:
+                return
+
+            self.switchSplit(largestCon)
+            self.moveWindow(smallestCon.id, largestCon.id)
+            self.index.remove(smallestCon.id)
+            self.index.insert(smallestCon.id, None, after=largestCon)
+
+
     def windowFocused(self, event, window):
         if self.isExcluded(window):
             return
 
+        if not self.index.matches(window):
+            self.index.clear()
         self.switchSplit(window)
 
 
+    def windowMoved(self, event, window):
+        if not self.index.matches(window):
+            self.index.clear()
+
+
@@ -15,9 +15,8 @@ A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License along with
 layman. If not, see <https://www.gnu.org/licenses/>.
 """
-from collections import deque
-
 from .WorkspaceLayoutManager import WorkspaceLayoutManager
+from ..stack import WindowStack, planMoves
 
 KEY_MASTER_WIDTH = "masterWidth"
 KEY_STACK_LAYOUT = "stackLayout"
@@ -32,15 +31,57 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
         super().__init__(con, workspace, options)
         self.masterId = 0
         self.stackId = 0
-        self.stack = deque([])
+        self.stack = WindowStack()
         self.masterWidth = options.getForWorkspace(self.workspaceNum, KEY_MASTER_WIDTH) or 50
         self.stackLayout = options.getForWorkspace(self.workspaceNum, KEY_STACK_LAYOUT) or "splitv"
         self.stackSide = options.getForWorkspace(self.workspaceNum, KEY_STACK_SIDE) or "right"
 
+
+    def arrange(self):
         # If windows exist, fit them into MasterStack
         self.arrangeUntrackedWindows()
 
 
+    def saveState(self):
+        if self.masterId == 0:
+            return None
+        return {"masterId": self.masterId, "stackId": self.stackId, "stack": list(self.stack)}
+
+
+    # The saved state is kept if master and the stack container are still
+    # side by side, and the stack container holds the windows in the stack
+    # that are still open. Windows opened since are arranged afterwards. The
+    # stack's layout and side are taken from the current config.
+    def restoreState(self, state):
+        workspace = self.getWorkspaceCon()
+        masterCon = workspace.find_by_id(state["masterId"])
+        if masterCon is None or len(masterCon.nodes) > 0 or self.isExcluded(masterCon):
+            return False
+
+        leaves = {x.id for x in workspace.leaves()}
+        stack = [x for x in state["stack"] if x in leaves]
+        stackCon = None
+        if state["stackId"] != 0:
+            stackCon = workspace.find_by_id(state["stackId"])
+            if stackCon is None or stackCon.parent.id != masterCon.parent.id:
+                return False
+            if len(stack) == 0 or {x.id for x in stackCon.nodes} != set(stack):
+                return False
+        elif len(stack) > 0:
+            return False
+
+        self.masterId = state["masterId"]
+        self.stackId = state["stackId"]
+        self.stack = WindowStack(stack)
+        if stackCon is not None:
+            if stackCon.layout != ("stacked" if self.stackLayout == "stacking" else self.stackLayout):
+                self.con.command("[con_id=%d] layout %s" % (self.stack[0], self.stackLayout))
+            if (stackCon.rect.x < masterCon.rect.x) != (self.stackSide == "left"):
+                self.setStackSide()
+        self.arrangeStack()
+        return True
+
+
     def windowAdded(self, event, window):
         # Ignore excluded windows
         if self.isExcluded(window):
@@ -53,19 +94,22 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
         topCon = self.getWorkspaceCon()
         self.pushWindow(window, topCon)
 
-        self.log("Added window id: %d" % window.id)
+        self.log("Added window id: %d", window.id)
         self.con.command("[con_id=%d] focus" % self.masterId)
 
 
     def windowRemoved(self, event, window):
-         # Ignore excluded windows
-        if self.isExcluded(window):
+        # Ignore excluded windows. The window given is the one focused after
+        # the close, or the workspace if it's now empty, so the closed one is
+        # checked from the event.
+        closed = event.container
+        if closed.type != "con" or (closed.floating is not None and "on" in closed.floating):
             return
 
         topCon = self.getWorkspaceCon()
-        self.popWindow(window, topCon)
+        self.popWindow(window, topCon, closed.id)
 
-        self.log("Removed window id: %d" % window.id)
+        self.log("Removed window id: %d", closed.id)
 
 
     def windowFocused(self, event, window):
@@ -95,6 +139,20 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
             self.toggleStackSide()
 
 
+    def optionsChanged(self, changes):
+        super().optionsChanged(changes)
+        if KEY_MASTER_WIDTH in changes:
+            self.masterWidth = changes[KEY_MASTER_WIDTH] or 50
+            if self.masterId != 0:
+                self.setMasterWidth()
+        if KEY_STACK_LAYOUT in changes:
+            self.stackLayout = changes[KEY_STACK_LAYOUT] or "splitv"
+            self.setStackLayout()
+        if KEY_STACK_SIDE in changes:
+            self.stackSide = changes[KEY_STACK_SIDE] or "right"
+            self.setStackSide()
+
+
     def isExcluded(self, window):
         if window is None:
             return True
@@ -119,7 +177,7 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
     def setMasterWidth(self):
         if self.masterWidth is not None:
             self.con.command("[con_id=%s] resize set width %s ppt" % (self.masterId, self.masterWidth))
-            self.logCaller("Set window %d width to %d" % (self.masterId, self.masterWidth))
+            self.logCaller("Set window %d width to %d", self.masterId, self.masterWidth)
 
 
     def setStackLayout(self):
@@ -134,6 +192,13 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
 
         self.log("Arranging untrackedWindows")
         untracked = [x for x in reversed(leaves) if x.id not in self.stack and x.id != self.masterId]
+        if len(untracked) == 0:
+            return
+
+        if self.masterId == 0 and self.stackId == 0 and len(untracked) > 2:
+            self.arrangeWindows([x.id for x in reversed(untracked)])
+            return
+
         for window in untracked:
             if self.stackId == 0:
                 if self.masterId == 0:
@@ -145,6 +210,26 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
         self.setStackSide()
 
 
+    # arrangeWindows gives the same layout as adding the windows one at a
+    # time, last to first, without reading the tree after each of them. The
+    # first window is master and the rest are stacked in order.
+    def arrangeWindows(self, windowIds):
+        masterId, stacked = windowIds[0], windowIds[1:]
+        bottomId = stacked[-1]
+        self.con.command("[con_id=%d] split none, layout splith" % bottomId)
+        self.moveWindow(masterId, bottomId)
+        self.con.command("[con_id=%d] split vertical, layout %s" % (bottomId, self.stackLayout))
+        self.stackId = self.getConById(bottomId).parent.id
+
+        with self.batch():
+            for windowId in stacked[:-1]:
+                self.moveWindow(windowId, self.stackId)
+            self.masterId = masterId
+            self.stack = WindowStack(reversed(stacked))
+            self.moveStack([bottomId] + stacked[:-1])
+        self.setStackSide()
+
+
     def initMaster(self, window):
         self.masterId = window.id
         self.con.command("[con_id=%d] split none, layout %s" % (self.masterId, "splith"))
@@ -164,8 +249,7 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
         self.con.command("[con_id=%d] split none, layout splith" % self.masterId)
         self.moveWindow(window.id, self.masterId)
         self.stack.append(self.masterId)
-        self.moveWindow(self.masterId, self.stackId)
-        self.moveToTopOfStack(self.masterId)
+        self.arrangeStack()
         self.masterId = window.id
 
 
@@ -196,37 +280,43 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
             self.setMasterWidth()
 
 
-    def moveToTopOfStack(self, windowId):
-        # The top of a tabbed layout is the closest to master, handle that
-        moveDirection = "up"
-        topIndex = 0
-        if self.stackLayout == "tabbed" and self.stackSide == "right":
-            moveDirection = "left"
-        elif self.stackLayout == "tabbed" and self.stackSide == "left":
-            moveDirection = "right"
-            topIndex = -1
+    # stackOrder returns the order the stack container's children should be
+    # in. The top of the stack is the child closest to master, which is the
+    # last child of a tabbed stack on the left, and the first otherwise.
+    def stackOrder(self):
+        if self.stackLayout == "tabbed" and self.stackSide == "left":
+            return list(self.stack)
+        return list(reversed(self.stack))
 
-        # Get stack container
-        try:
-            stackCon = self.getConById(windowId).parent
-        except AttributeError:
-            # Window not in stack
-            self.moveWindow(windowId, self.stack[0])
-            stackCon = self.getConById(windowId).parent
-
-        # Move the previous master to top of stack
-        while stackCon is not None and stackCon.nodes[topIndex].id != windowId:
-            self.con.command("[con_id=%d] move %s" % (windowId, moveDirection))
-            stackCon = self.getConById(windowId).parent
-            if stackCon.id != self.stackId:
-                self.moveWindow(windowId, self.stackId)
-                stackCon = self.getConById(self.stackId)
+
+    # arrangeStack makes the stack container match the stack, moving windows
+    # that are out of place or outside of it. It reads the tree once, and
+    # sends every move in one batch.
+    def arrangeStack(self):
+        stackCon = self.getConById(self.stackId)
+        if stackCon is None:
+            return
+
+        self.moveStack([x.id for x in stackCon.nodes])
+
+
+    # moveStack moves the windows in the stack container, which are in the
+    # order given, to the order of the stack. The moves are sent in one batch.
+    def moveStack(self, current):
+        with self.batch():
+            for move, windowId, targetId in planMoves(current, self.stackOrder()):
+                if move == "after":
+                    self.moveWindow(windowId, targetId)
+                elif move == "swap":
+                    self.con.command("[con_id=%d] swap container with con_id %d" % (windowId, targetId))
+                else:
+                    self.moveWindow(windowId, self.stackId)
 
 
     def popFromStack(self, windowId, leaves):
         # Master destroyed, pop from stack
         self.masterId = windowId
-        self.log("Master removed, popping %d from stack." % self.masterId)
+        self.log("Master removed, popping %d from stack.", self.masterId)
         if len(leaves) == 1:
             # Stack empty, make last window master
             self.con.command("[con_id=%d] layout splith" % self.masterId)
@@ -235,15 +325,22 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
             self.stackId = 0
         else:
             moveDirection = "left" if self.stackSide == "right" else "right"
-            try:
-                while self.getConById(self.masterId).parent.id == self.stackId:
+            stackCon = self.getConById(self.stackId)
+            nodeIds = [x.id for x in stackCon.nodes] if stackCon is not None else []
+            if self.masterId not in nodeIds:
+                self.log("New master %d moved out of stack", self.masterId)
+            else:
+                # Moving toward master leaves a vertical stack from anywhere,
+                # and a tabbed stack from the end nearest master
+                edgeId = nodeIds[0] if moveDirection == "left" else nodeIds[-1]
+                with self.batch():
+                    if stackCon.layout in ("splith", "tabbed") and edgeId != self.masterId:
+                        self.con.command("[con_id=%d] swap container with con_id %d" % (self.masterId, edgeId))
                     self.con.command("[con_id=%d] move %s" % (self.masterId, moveDirection))
-            except AttributeError:
-                self.log("New master %d moved out of stack" % self.masterId)
         self.setMasterWidth()
 
 
-    def popWindow(self, window, topCon):
+    def popWindow(self, window, topCon, removedId):
         leaves = topCon.leaves()
         masterCon = topCon.find_by_id(self.masterId)
         stackCon = topCon.find_by_id(self.stackId)
@@ -269,10 +366,15 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
             self.popFromStack(newMaster, leaves)
         elif len(topCon.nodes) == 1 and len(leaves) > 1:
             # Layout is wrapped in another container, recurse
-            self.popWindow(window, topCon.nodes[0])
+            self.popWindow(window, topCon.nodes[0], removedId)
         else:
             # A stack item was destroyed
             self.setMasterWidth()
+            if removedId in self.stack:
+                self.stack.remove(removedId)
+                return
+
+            # Find it in the stack if it wasn't the window the event was for
             allWindowIds = {window.id for window in leaves}
             for id in self.stack:
                 if id not in allWindowIds:
@@ -294,7 +396,7 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
         # Apply the new stack layout
         if len(self.stack) != 0:
             self.con.command("[con_id=%d] layout %s" % (self.stack[0], self.stackLayout))
-            self.log("Changed stackLayout to %s" % self.stackLayout)
+            self.log("Changed stackLayout to %s", self.stackLayout)
 
 
     def toggleStackSide(self):
@@ -330,20 +432,20 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
             self.con.command("[con_id=%d] swap container with con_id %d" % (targetId, self.masterId))
             self.stack.append(self.masterId)
             self.masterId = targetId
-            self.log("Swapped window %d with master" % targetId)
+            self.log("Swapped window %d with master", targetId)
             return
 
         # Swap window with window above
         try:
             index = self.stack.index(focusedWindow.id)
         except ValueError:
-            self.log("Window %d not found in stack" % focusedWindow.id)
+            self.log("Window %d not found in stack", focusedWindow.id)
             return
 
-        self.con.command("[con_id=%d] swap container with con_id %d" % (focusedWindow.id, self.stack[index+1]))
-        self.stack[index] = self.stack[index+1]
-        self.stack[index+1] = focusedWindow.id
-        self.log("Swapped window %d with %d" % (focusedWindow.id, self.stack[index]))
+        aboveId = self.stack[index+1]
+        self.con.command("[con_id=%d] swap container with con_id %d" % (focusedWindow.id, aboveId))
+        self.stack.swap(focusedWindow.id, aboveId)
+        self.log("Swapped window %d with %d", focusedWindow.id, aboveId)
 
 
     def moveDown(self):
@@ -366,20 +468,20 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
             self.con.command("[con_id=%d] swap container with con_id %d" % (focusedWindow.id, self.stack[-1]))
             self.masterId = self.stack.pop()
             self.stack.append(focusedWindow.id)
-            self.log("Swapped master %d with top of stack %d" % (self.stack[-1], self.masterId))
+            self.log("Swapped master %d with top of stack %d", self.stack[-1], self.masterId)
             return
 
         # Swap window with window below
         try:
             index = self.stack.index(focusedWindow.id)
         except ValueError:
-            self.log("Window %d not found in stack" % focusedWindow.id)
+            self.log("Window %d not found in stack", focusedWindow.id)
             return
 
-        self.con.command("[con_id=%d] swap container with con_id %d" % (focusedWindow.id, self.stack[index-1]))
-        self.stack[index] = self.stack[index-1]
-        self.stack[index-1] = focusedWindow.id
-        self.log("Swapped window %d with %d" % (focusedWindow.id, self.stack[index]))
+        belowId = self.stack[index-1]
+        self.con.command("[con_id=%d] swap container with con_id %d" % (focusedWindow.id, belowId))
+        self.stack.swap(focusedWindow.id, belowId)
+        self.log("Swapped window %d with %d", focusedWindow.id, belowId)
 
 
     def rotateCCW(self):
@@ -452,16 +554,14 @@ class MasterStackLayoutManager(WorkspaceLayoutManager):
             return
 
         # Find focused window in record
-        for i in range(len(self.stack)):
-            if self.stack[i] == focusedWindow.id:
-                # Swap window with master
-                self.con.command("[con_id=%d] swap container with con_id %d" % (focusedWindow.id, self.masterId))
-
-                # Update record
-                self.stack[i] = self.masterId
-                self.masterId = focusedWindow.id
-                self.log("Swapped master with window %d" % focusedWindow.id)
-
-                # Refocus master
-                self.con.command("[con_id=%d] focus" % self.masterId)
-                return
+        if focusedWindow.id in self.stack:
+            # Swap window with master
+            self.con.command("[con_id=%d] swap container with con_id %d" % (focusedWindow.id, self.masterId))
+
+            # Update record
+            self.stack.replace(focusedWindow.id, self.masterId)
+            self.masterId = focusedWindow.id
+            self.log("Swapped master with window %d", focusedWindow.id)
+
+            # Refocus master
+            self.con.command("[con_id=%d] focus" % self.masterId)
@@ -15,9 +15,8 @@ A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License along with
 layman. If not, see <https://www.gnu.org/licenses/>. 
 """
-import inspect
-
-from ..config import KEY_DEBUG
+from ..config import KEY_DEBUG, KEY_LOG_LEVEL
+from .. import logger
 
 class WorkspaceLayoutManager:
     # These properties should be overriden to configure your WLM as
@@ -25,6 +24,7 @@ class WorkspaceLayoutManager:
     shortName = "none"
     overridesMoveBinds = False # Should window movement commands be sent as binds
     supportsFloating = False # Should windowFloating be used, or treated as Added/Removed
+    isAsync = False # Are the functions below coroutines, see AsyncWorkspaceLayoutManager
 
     # These are the functions you should override for to implement a
     # WLM. 
@@ -32,7 +32,32 @@ class WorkspaceLayoutManager:
         self.con = con
         self.workspaceId = workspace.ipc_data["id"]
         self.workspaceNum = workspace.num
+        self.moveMark = "move_target_%d" % self.workspaceId
         self.debug = options.getForWorkspace(self.workspaceNum, KEY_DEBUG)
+        self.logLevel = logger.getLevel(options.getForWorkspace(self.workspaceNum, KEY_LOG_LEVEL))
+        self.logSource = "%s %d" % (self.shortName, self.workspaceNum)
+
+
+    # arrange is called once the manager is created, to fit the windows
+    # already on the workspace into the layout. Commands sent from it are
+    # batched, and at startup every workspace is arranged in parallel.
+    def arrange(self):
+        pass
+
+
+    # saveState returns the manager's state as a new dict that can be written
+    # as JSON, or None if it has none. It's called after every handler, and
+    # the state is only written to disk when it changed.
+    def saveState(self):
+        return None
+
+
+    # restoreState is called before arrange when layman starts, with the
+    # state saved by a manager of the same layout on the workspace before
+    # layman was restarted. Return True if it still matches the tree and was
+    # restored, or False to have the workspace arranged from scratch.
+    def restoreState(self, state):
+        return False
 
 
     # windowAdded is called when a new window is added to the workpsace,
@@ -41,6 +66,15 @@ class WorkspaceLayoutManager:
         pass
 
 
+    # windowsAdded is called instead of windowAdded when more windows were
+    # added to the workspace while the first was waiting to be handled, with
+    # the events and windows in the order they were added. Override it to
+    # place them all at once, by default windowAdded is called for each.
+    def windowsAdded(self, events, windows):
+        for event, window in zip(events, windows):
+            self.windowAdded(event, self.getConById(window.id) or window)
+
+
     # windowRemoved is called when a window is removed from the workspace,
     # either by being closed or moved to a different workspace.
     def windowRemoved(self, event, window):
@@ -62,44 +96,75 @@ class WorkspaceLayoutManager:
         pass
 
 
+    # workspaceResized is called when the workspace changes size, like when
+    # its output is rotated, rescaled or docked, or it's moved to an output
+    # with a different size.
+    def workspaceResized(self, event):
+        pass
+
+
     # onBinding is called when a key binding is pressed while the workspace
     # is focused.
     def onBinding(self, command):
         pass
 
 
-    # moveWindow is a helper function for moving a window to a container
+    # optionsChanged is called when the config file is changed or reloaded,
+    # with a dict of the options that changed for the workspace and their new
+    # values. Removed options have the value None. Call the parent class
+    # when overriding this.
+    def optionsChanged(self, changes):
+        if KEY_DEBUG in changes:
+            self.debug = changes[KEY_DEBUG]
+        if KEY_LOG_LEVEL in changes:
+            self.logLevel = logger.getLevel(changes[KEY_LOG_LEVEL])
+
+
+    # batch is a helper function for sending several commands to sway in one
+    # message. Commands sent inside it still return their own replies, but
+    # reading a reply or the tree sends the commands queued so far. Layman
+    # already batches every event and binding handler.
+    def batch(self):
+        return self.con.batch()
+
+
+    # moveWindow is a helper function for moving a window to a container. The
+    # mark it uses is unique to the workspace, since managers for different
+    # workspaces run at the same time.
     def moveWindow(self, moveId, targetId):
-        self.con.command("[con_id=%d] mark --add move_target" % targetId)
-        self.con.command("[con_id=%d] move window to mark move_target" % moveId)
-        self.con.command("[con_id=%d] unmark move_target" % targetId)
-        self.logCaller("Moved window %s to mark on container %s" % (moveId, targetId))
+        with self.batch():
+            self.con.command("[con_id=%d] mark --add %s" % (targetId, self.moveMark))
+            self.con.command("[con_id=%d] move window to mark %s" % (moveId, self.moveMark))
+            self.con.command("[con_id=%d] unmark %s" % (targetId, self.moveMark))
+        self.logCaller("Moved window %s to mark on container %s", moveId, targetId)
 
 
     # moveContainer is a helper function for moving a container to another container
     def moveContainer(self, moveId, targetId):
-        self.con.command("[con_id=%d] mark --add move_target" % targetId)
-        self.con.command("[con_id=%d] move container to mark move_target" % moveId)
-        self.con.command("[con_id=%d] unmark move_target" % targetId)
-        self.logCaller("Moved container %s to mark on window %s" % (moveId, targetId))
+        with self.batch():
+            self.con.command("[con_id=%d] mark --add %s" % (targetId, self.moveMark))
+            self.con.command("[con_id=%d] move container to mark %s" % (moveId, self.moveMark))
+            self.con.command("[con_id=%d] unmark %s" % (targetId, self.moveMark))
+        self.logCaller("Moved container %s to mark on window %s", moveId, targetId)
 
 
     # This log function includes the class name, workspace number, and the 
     # name of the function it is called by. This makes it useful for functions
-    # that are called in response to events.
-    def log(self, msg):
-        if self.debug:
-            print(("%s %d: %s: %s" % (self.shortName, self.workspaceNum, inspect.stack()[1][3], msg)))
+    # that are called in response to events. Pass any values as arguments
+    # rather than formatting msg, it's only formatted if it's printed or dumped.
+    def log(self, msg, *args):
+        logger.record(logger.DEBUG, self.logLevel, self.debug, self.logSource, 1, msg, args)
 
 
     # This log function includes the class name, workspace number, and the 
     # name of the function 2 calls up. This makes it useful for helper
     # functions that get called by event handlers
-    def logCaller(self, msg):
-        if self.debug:
-            print(("%s %d: %s: %s" % (self.shortName, self.workspaceNum, inspect.stack()[2][3], msg)))
+    def logCaller(self, msg, *args):
+        logger.record(logger.DEBUG, self.logLevel, self.debug, self.logSource, 2, msg, args)
 
-    # These are some helper functions for getting container ids
+    # These are some helper functions for getting container ids. Layman hands
+    # managers a connection that caches the tree for the current event, so
+    # calling these repeatedly only fetches the tree again after a command.
     def getWorkspaceCon(self):
         return self.con.get_tree().find_by_id(self.workspaceId)
 
@@ -110,3 +175,80 @@ class WorkspaceLayoutManager:
 
     def getConById(self, conId):
         return self.con.get_tree().find_by_id(conId)
+
+
+class AsyncWorkspaceLayoutManager(WorkspaceLayoutManager):
+    """
+    Base class for layouts whose handlers are coroutines. These layouts are only
+    loaded when layman is started with --asyncio, which gives them an
+    AsyncLaymanConnection and awaits their handlers on the event loop. Commands
+    that don't depend on each other can be sent together with
+    self.con.pipeline().
+    """
+    isAsync = True
+
+    async def arrange(self):
+        pass
+
+
+    async def windowAdded(self, event, window):
+        pass
+
+
+    async def windowsAdded(self, events, windows):
+        for event, window in zip(events, windows):
+            await self.windowAdded(event, (await self.getConById(window.id)) or window)
+
+
+    async def windowRemoved(self, event, window):
+        pass
+
+
+    async def windowFocused(self, event, window):
+        pass
+
+
+    async def windowMoved(self, event, window):
+        pass
+
+
+    async def windowFloating(self, event, window):
+        pass
+
+
+    async def workspaceResized(self, event):
+        pass
+
+
+    async def onBinding(self, command):
+        pass
+
+
+    async def optionsChanged(self, changes):
+        super().optionsChanged(changes)
+
+
+    async def moveWindow(self, moveId, targetId):
+        await self.con.pipeline("[con_id=%d] mark --add %s" % (targetId, self.moveMark),
+                                "[con_id=%d] move window to mark %s" % (moveId, self.moveMark),
+                                "[con_id=%d] unmark %s" % (targetId, self.moveMark))
+        self.logCaller("Moved window %s to mark on container %s", moveId, targetId)
+
+
+    async def moveContainer(self, moveId, targetId):
+        await self.con.pipeline("[con_id=%d] mark --add %s" % (targetId, self.moveMark),
+                                "[con_id=%d] move container to mark %s" % (moveId, self.moveMark),
+                                "[con_id=%d] unmark %s" % (targetId, self.moveMark))
+        self.logCaller("Moved container %s to mark on window %s", moveId, targetId)
+
+
+    async def getWorkspaceCon(self):
+        return (await self.con.get_tree()).find_by_id(self.workspaceId)
+
+
+    async def getFocusedCon(self):
+        return (await self.con.get_tree()).find_focused()
+
+
+    async def getConById(self, conId):
+        return (await self.con.get_tree()).find_by_id(conId)
@@ -15,46 +15,131 @@ A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License along with
 layman. If not, see <https://www.gnu.org/licenses/>. 
 """
-from os import unlink, mkfifo
-from queue import Queue
+import asyncio
+import json
+from os import chmod, unlink
+import socket
 from threading import Thread
+import time
 
-PIPE = "/tmp/layman.pipe"
+from .client import REPLY_SUCCESS, getSocketPath
 
-class MessageQueue(Queue):
-    def __init__(self, maxsize=0):
-        super().__init__(maxsize=0)
-        self.on_change_listeners = []
 
-    def _put(self, msg):
-        # Add to queue
-        super()._put(msg)
+# encodeReply builds the line sent back to a client for one command.
+def encodeReply(error, started, result=None):
+    reply = {"elapsed": round((time.perf_counter() - started) * 1000, 3)}
+    if result is not None:
+        reply["result"] = result
+    if error is None:
+        # The client checks for this prefix rather than parsing the reply
+        return REPLY_SUCCESS + (json.dumps(reply)[1:] + "\n").encode()
+    return (json.dumps({"success": False, "error": error, **reply}) + "\n").encode()
 
-        # Run any listeners on a separate thread
-        for listener in self.on_change_listeners:
-            listener(msg)
-
-    def registerListener(self, listener):
-        self.on_change_listeners.append(listener)
 
 class MessageServer():
+    """
+    Accepts commands on a unix socket. Clients may stay connected and send any
+    number of commands, one per line, and get a line of JSON back for each
+    one, in order, once it has been handled:
+
+        {"success": true, "error": null, "elapsed": 1.234}
 
+    The callback is given each command and returns a concurrent.futures.Future
+    that finishes when the command has been handled, or raises an exception
+    if it failed. Commands that report something, like "queue", put it in the
+    reply's "result".
+    """
     def __init__(self, callback):
         self.callback = callback
-        self.queue = MessageQueue()
-        self.queue.registerListener(callback)
+        self.path = getSocketPath()
+        self.asyncServer = None
 
         try:
-            unlink(PIPE)
-        except:
-            "do nothing"
+            unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+    # start accepts clients on a separate thread, each client gets a thread
+    # of its own
+    def start(self):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.path)
+        chmod(self.path, 0o600)
+        self.socket.listen()
+        self.thread = Thread(target=self.acceptClients, daemon=True)
+        self.thread.start()
 
-        mkfifo(PIPE)
-        thread = Thread(target=self.readPipe)
-        thread.start()
 
-    def readPipe(self):
+    def acceptClients(self):
         while True:
-            with open(PIPE) as fifo:
-                self.queue.put(fifo.read())
+            try:
+                client, _ = self.socket.accept()
+            except OSError:
+                # The socket was closed by stop
+                return
+            thread = Thread(target=self.serveClient, args=(client,), daemon=True)
+            thread.start()
+
+
+    # stop closes the listening socket, which ends the thread accepting
+    # clients. Clients that are already connected are still served.
+    def stop(self):
+        if self.asyncServer is not None:
+            self.asyncServer.close()
+            return
+
+        try:
+            # Wakes the thread blocked in accept, closing alone doesn't
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        self.thread.join()
+
+
+    def serveClient(self, client):
+        with client, client.makefile("rb") as lines:
+            for line in lines:
+                command = line.decode().strip()
+                if command == "":
+                    continue
+                started = time.perf_counter()
+                error = result = None
+                try:
+                    result = self.callback(command).result()
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                try:
+                    client.sendall(encodeReply(error, started, result))
+                except OSError:
+                    return
+
 
+    # startAsync accepts clients on the running asyncio event loop instead
+    async def startAsync(self):
+        self.asyncServer = await asyncio.start_unix_server(self.serveClientAsync, path=self.path)
+        chmod(self.path, 0o600)
+
+
+    async def serveClientAsync(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode().strip()
+                if command == "":
+                    continue
+                started = time.perf_counter()
+                error = result = None
+                try:
+                    result = await asyncio.wrap_future(self.callback(command))
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                writer.write(encodeReply(error, started, result))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,255 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+from bisect import bisect_left
+
+# Room left at each end of the slots when they're rebuilt
+MIN_ROOM = 8
+
+
+class WindowStack:
+    """
+    An ordered list of window ids, from the bottom of a stack (index 0) to the
+    top (index -1), with the deque methods MasterStack uses. Each id is kept in
+    a slot, and a dict maps ids to their slot, so membership, swapping two ids
+    and replacing one are O(1). Removed ids leave an empty slot behind, and a
+    Fenwick tree counting filled slots finds positions in O(log n). Either end
+    can be pushed and popped in amortized O(1), so rotating doesn't move every
+    id. The slots are only rebuilt when an end runs out of room, or when most
+    of them are empty.
+    """
+    def __init__(self, ids=()):
+        self.clear()
+        for windowId in ids:
+            self.append(windowId)
+
+
+    def __len__(self):
+        return len(self.slotOf)
+
+
+    def __contains__(self, windowId):
+        return windowId in self.slotOf
+
+
+    def __iter__(self):
+        for slot in range(self.head, self.tail):
+            if self.slots[slot] is not None:
+                yield self.slots[slot]
+
+
+    def __getitem__(self, index):
+        return self.slots[self.slotAt(index)]
+
+
+    def __setitem__(self, index, windowId):
+        self.replace(self[index], windowId)
+
+
+    def __repr__(self):
+        return "WindowStack(%s)" % list(self)
+
+
+    def clear(self):
+        self.slots = [None] * (2 * MIN_ROOM)
+        self.counts = [0] * (len(self.slots) + 1)
+        self.slotOf = {}
+        self.head = self.tail = MIN_ROOM
+
+
+    def index(self, windowId):
+        if windowId not in self.slotOf:
+            raise ValueError("%s is not in the stack" % windowId)
+        return self.countBefore(self.slotOf[windowId])
+
+
+    def append(self, windowId):
+        if self.tail == len(self.slots):
+            self.rebuild()
+        self.fill(self.tail, windowId)
+        self.tail += 1
+
+
+    def appendleft(self, windowId):
+        if self.head == 0:
+            self.rebuild()
+        self.head -= 1
+        self.fill(self.head, windowId)
+
+
+    def pop(self):
+        windowId = self[-1]
+        self.remove(windowId)
+        return windowId
+
+
+    def popleft(self):
+        windowId = self[0]
+        self.remove(windowId)
+        return windowId
+
+
+    def remove(self, windowId):
+        slot = self.slotOf.pop(windowId)
+        self.slots[slot] = None
+        self.update(slot, -1)
+        self.trim()
+
+
+    # swap exchanges the positions of two ids in the stack.
+    def swap(self, first, second):
+        firstSlot, secondSlot = self.slotOf[first], self.slotOf[second]
+        self.slots[firstSlot], self.slots[secondSlot] = second, first
+        self.slotOf[first], self.slotOf[second] = secondSlot, firstSlot
+
+
+    # replace puts newId in oldId's position, newId must not be in the stack.
+    def replace(self, oldId, newId):
+        slot = self.slotOf.pop(oldId)
+        self.slots[slot] = newId
+        self.slotOf[newId] = slot
+
+
+    """
+    Slots
+
+    The following functions map positions to slots and keep the Fenwick tree
+    of filled slots up to date.
+    """
+
+    def fill(self, slot, windowId):
+        if windowId in self.slotOf:
+            raise ValueError("%s is already in the stack" % windowId)
+        self.slots[slot] = windowId
+        self.slotOf[windowId] = slot
+        self.update(slot, 1)
+
+
+    def slotAt(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("stack index out of range")
+
+        # The ends are kept filled by trim, so they don't need a search
+        if index == 0:
+            return self.head
+        if index == len(self) - 1:
+            return self.tail - 1
+
+        # Find the slot with `index` filled slots before it
+        slot = 0
+        step = 1 << (len(self.slots).bit_length() - 1)
+        while step > 0:
+            if slot + step <= len(self.slots) and self.counts[slot + step] <= index:
+                slot += step
+                index -= self.counts[slot]
+            step >>= 1
+        return slot
+
+
+    def countBefore(self, slot):
+        count = 0
+        while slot > 0:
+            count += self.counts[slot]
+            slot -= slot & -slot
+        return count
+
+
+    def update(self, slot, delta):
+        slot += 1
+        while slot < len(self.counts):
+            self.counts[slot] += delta
+            slot += slot & -slot
+
+
+    # trim moves the ends past empty slots, and rebuilds the slots once most
+    # of them are empty.
+    def trim(self):
+        while self.head < self.tail and self.slots[self.head] is None:
+            self.head += 1
+        while self.tail > self.head and self.slots[self.tail - 1] is None:
+            self.tail -= 1
+        if self.tail - self.head > 2 * len(self) + MIN_ROOM:
+            self.rebuild()
+
+
+    def rebuild(self):
+        ids = list(self)
+        room = max(MIN_ROOM, len(ids) // 2)
+        self.slots = [None] * room + ids + [None] * room
+        self.slotOf = {windowId: room + i for i, windowId in enumerate(ids)}
+        self.head = room
+        self.tail = room + len(ids)
+
+        # Build the Fenwick tree in O(n)
+        self.counts = [0] + [0 if x is None else 1 for x in self.slots]
+        for i in range(1, len(self.counts)):
+            parent = i + (i & -i)
+            if parent < len(self.counts):
+                self.counts[parent] += self.counts[i]
+
+
+# planMoves returns the moves that put the ids in `current` into the order of
+# `target`, as ("after", id, otherId) to move id to just after otherId,
+# ("swap", id, otherId), and ("into", id, None) to move id into the empty
+# container. Ids in the longest run already in target order stay
+# put, every other id is moved once. Ids of target that aren't in current are
+# moved in too, ids only in current are left where they are.
+def planMoves(current, target):
+    positions = {windowId: i for i, windowId in enumerate(current)}
+    stable = increasingRun([positions.get(windowId, -1) for windowId in target])
+
+    moves = []
+    for i, windowId in enumerate(target):
+        if i in stable:
+            continue
+        if i > 0:
+            moves.append(("after", windowId, target[i - 1]))
+        elif len(current) > 0:
+            # Nothing goes before it, so move it after the first and swap
+            moves.append(("after", windowId, current[0]))
+            moves.append(("swap", windowId, current[0]))
+        else:
+            moves.append(("into", windowId, None))
+    return moves
+
+
+# increasingRun returns the indexes of the longest increasing subsequence of
+# positions, ignoring negative positions.
+def increasingRun(positions):
+    tails = []
+    tailIndexes = []
+    previous = [None] * len(positions)
+    for i, position in enumerate(positions):
+        if position < 0:
+            continue
+        j = bisect_left(tails, position)
+        if j == len(tails):
+            tails.append(position)
+            tailIndexes.append(i)
+        else:
+            tails[j] = position
+            tailIndexes[j] = i
+        previous[i] = tailIndexes[j - 1] if j > 0 else None
+
+    run = set()
+    i = tailIndexes[-1] if tailIndexes else None
+    while i is not None:
+        run.add(i)
+        i = previous[i]
+    return run
@@ -0,0 +1,95 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+import json
+from os import environ, getuid, replace
+from threading import Lock
+
+STATE_VERSION = 1
+
+
+# getStatePath returns the path of the state file, next to the control socket.
+def getStatePath():
+    runtimeDir = environ.get("XDG_RUNTIME_DIR")
+    if runtimeDir:
+        return runtimeDir + "/layman-state.json"
+    return "/tmp/layman-state-%d.json" % getuid()
+
+
+class StateStore:
+    """
+    Keeps the state layout managers save, so that layman can pick up where it
+    left off after a crash or an upgrade, rather than arranging every
+    workspace again. Each workspace's state is kept with the layout and the
+    workspace id it was saved for, and the file is rewritten whenever any of
+    it changes:
+
+        {"version": 1, "workspaces": {"1": {"layout": "MasterStack", "id": 5, "state": {...}}}}
+
+    Container ids are only unique within a sway session, and the runtime
+    directory is cleared when the user logs out. A workspace id that doesn't
+    match is enough to tell that a state is from an older session.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.workspaces = self.read()
+
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(data, dict) or data.get("version") != STATE_VERSION:
+            return {}
+        return data.get("workspaces") or {}
+
+
+    # get returns the state saved for a workspace by a manager of the given
+    # layout, or None if there isn't one.
+    def get(self, workspaceNum, workspaceId, shortName):
+        with self.lock:
+            entry = self.workspaces.get(str(workspaceNum))
+        if entry is None or entry.get("layout") != shortName or entry.get("id") != workspaceId:
+            return None
+        return entry.get("state")
+
+
+    # set records the state of a workspace's manager, None clears it. The
+    # file is only written if it changed.
+    def set(self, workspaceNum, workspaceId, shortName, state):
+        key = str(workspaceNum)
+        entry = None if state is None else {"layout": shortName, "id": workspaceId, "state": state}
+        with self.lock:
+            if self.workspaces.get(key) == entry:
+                return
+            if entry is None:
+                del self.workspaces[key]
+            else:
+                self.workspaces[key] = entry
+            self.write()
+
+
+    # write replaces the file, so a crash while writing leaves the last one.
+    def write(self):
+        path = self.path + ".tmp"
+        with open(path, "w") as f:
+            json.dump({"version": STATE_VERSION, "workspaces": self.workspaces}, f, separators=(",", ":"))
+        replace(path, self.path)
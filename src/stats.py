@@ -0,0 +1,115 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>. 
+"""
+from collections import deque
+from threading import Lock
+
+SAMPLES = 1000
+
+
+class Histogram:
+    """
+    Keeps the last `size` samples of a measurement, along with totals since
+    it was created, and reports percentiles over the samples it has.
+    """
+    def __init__(self, size=SAMPLES):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+
+    def report(self):
+        samples = sorted(self.samples)
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))], 3) if samples else 0
+
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else 0,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(self.max, 3),
+        }
+
+
+class EventStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.fetches = 0
+        self.commands = 0
+        self.messages = 0
+
+
+    def report(self):
+        count = self.latency.count or 1
+        return {
+            "latency": self.latency.report(),
+            "fetches": self.fetches,
+            "commands": self.commands,
+            "messages": self.messages,
+            "fetchesPerEvent": round(self.fetches / count, 2),
+            "commandsPerEvent": round(self.commands / count, 2),
+        }
+
+
+class Stats:
+    """
+    Records how long each kind of event took to handle and how much it talked
+    to sway, by the manager that handled it. Latency runs from when layman
+    received the event to when the handler's last command was sent, in
+    milliseconds. Workers record into it from their own threads.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.events = {}
+
+
+    # record adds one handled event. usage is the (fetches, commands, messages)
+    # the handler's connection counted while it ran.
+    def record(self, name, handler, latency, usage):
+        with self.lock:
+            stats = self.events.get((name, handler))
+            if stats is None:
+                stats = self.events[(name, handler)] = EventStats()
+            stats.latency.add(latency * 1000)
+            stats.fetches += usage[0]
+            stats.commands += usage[1]
+            stats.messages += usage[2]
+
+
+    def report(self):
+        with self.lock:
+            return {"%s %s" % key: stats.report() for key, stats in sorted(self.events.items())}
+
+
+    def reset(self):
+        with self.lock:
+            self.events = {}
+
+
+# usageSince returns how much a connection was used since counters were read.
+def usageSince(con, counters):
+    return tuple(x - y for x, y in zip(con.counters(), counters))
@@ -0,0 +1,98 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>. 
+"""
+import gzip
+import json
+from threading import Lock
+import time
+
+TRACE_VERSION = 1
+
+
+class TraceRecorder:
+    """
+    Writes everything layman receives to a trace file, one JSON object per
+    line, so that a session can be replayed later with benchmarks/replay.py.
+    Paths ending in .gz are compressed. The file starts with a header holding
+    the config and the tree layman started with, followed by:
+
+        {"kind": "event", "seq": 1, "t": 0.52, "type": "window", "payload": {...}}
+        {"kind": "command", "seq": 2, "t": 1.07, "command": "swap master"}
+        {"kind": "tree", "seq": 1, "tree": {...}}
+
+    Events and commands are written as they arrive, with the seconds since
+    recording started. A tree record holds the tree layman routed an event
+    with, and is only written when it differs from the last one written. The
+    seq of each event is queued with it, so a tree is written under the event
+    it was routed for.
+    """
+    def __init__(self, path, config, tree):
+        self.file = gzip.open(path, "wt") if path.endswith(".gz") else open(path, "w")
+        self.lock = Lock()
+        self.started = time.monotonic()
+        self.seq = 0
+        self.lastTree = tree
+        self.write({"kind": "header", "version": TRACE_VERSION, "time": time.time(),
+                    "config": config, "tree": tree})
+
+
+    def write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self.file.flush()
+
+
+    def nextSeq(self):
+        with self.lock:
+            self.seq += 1
+            return self.seq
+
+
+    # recordEvent writes an event, and returns its seq.
+    def recordEvent(self, event):
+        seq = self.nextSeq()
+        # i3ipc names event classes after the event type, like WindowEvent
+        eventType = type(event).__name__[:-len("Event")].lower()
+        self.write({"kind": "event", "seq": seq, "t": round(time.monotonic() - self.started, 6),
+                    "type": eventType, "payload": event.ipc_data})
+        return seq
+
+
+    def recordCommand(self, command):
+        seq = self.nextSeq()
+        self.write({"kind": "command", "seq": seq, "t": round(time.monotonic() - self.started, 6),
+                    "command": command})
+
+
+    # recordTree is called once an event has been routed, with the seq it was
+    # recorded with and the snapshot it was routed with, as ipc data.
+    def recordTree(self, seq, tree):
+        if seq is None or tree is None or tree is self.lastTree or tree == self.lastTree:
+            return
+        self.lastTree = tree
+        self.write({"kind": "tree", "seq": seq, "tree": tree})
+
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+# readTrace returns the records of a trace file in order.
+def readTrace(path):
+    with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,360 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+import time
+
+# Rects in event payloads may differ from the model by borders and gaps,
+# anything further off than this means the model missed a change
+DRIFT_TOLERANCE = 64
+RECONCILE_INTERVAL = 10
+
+
+class TreeModel:
+    """
+    A local copy of sway's container tree that is kept up to date from window
+    and workspace event payloads, rather than fetching the whole tree for every
+    event. The model is rebuilt from a real get_tree() when it is first used,
+    every `interval` seconds, and whenever an event doesn't match the model or
+    describes a change the model can't follow on its own.
+
+    The model isn't thread safe, LaymanConnection only reads and edits it while
+    holding its lock.
+    """
+    def __init__(self, con, interval=None):
+        self.con = con
+        self.interval = interval or RECONCILE_INTERVAL
+        self.tree = None
+        self.focused = None
+        self.byId = {}
+        self.reconciledAt = 0
+        self.reconciles = 0
+        self.drifts = 0
+
+
+    """
+    Queries
+
+    The following functions are used by LaymanConnection to serve lookups from
+    the model.
+    """
+
+    def get(self):
+        tree = self.tree
+        if tree is None or time.monotonic() - self.reconciledAt > self.interval:
+            tree = self.reconcile()
+        return tree
+
+
+    def findById(self, conId):
+        self.get()
+        return self.byId.get(conId)
+
+
+    # data returns the model as ipc data, like sway's reply to get_tree.
+    def data(self):
+        return dataOf(self.get())
+
+
+    def reconcile(self):
+        self.tree = self.con.get_tree()
+        self.byId = {con.id: con for con in self.tree}
+        self.byId[self.tree.id] = self.tree
+        self.focused = self.tree.find_focused()
+        self.reconciledAt = time.monotonic()
+        self.reconciles += 1
+        return self.tree
+
+
+    def markDirty(self):
+        self.tree = None
+
+
+    def drift(self):
+        self.drifts += 1
+        self.markDirty()
+
+
+    """
+    Event updates
+
+    The following functions apply event payloads to the model. Anything they
+    can't apply confidently marks the model dirty, so the next lookup reconciles.
+    """
+
+    def applyEvent(self, event):
+        if self.tree is None or event is None:
+            return
+
+        change = event.change
+        if hasattr(event, "container"):
+            if change == "focus":
+                self.windowFocused(event.container)
+            elif change == "new":
+                self.windowNew(event.container)
+            elif change == "close":
+                self.windowClosed(event.container)
+            elif change in ("title", "mark", "urgent"):
+                pass
+            else:
+                # Moves and floating toggles don't say where the window went
+                self.markDirty()
+        elif hasattr(event, "current"):
+            if change == "init":
+                self.workspaceInit(event.current)
+            elif change == "empty":
+                self.workspaceEmpty(event.current)
+            elif change == "focus":
+                self.workspaceFocused(event.current)
+            elif change not in ("urgent", "reload"):
+                self.markDirty()
+        else:
+            # Output changes affect the geometry of everything on them
+            self.markDirty()
+
+
+    # applyCommand is called for every command layman sends. Focus and layout
+    # changes are applied directly, anything else may restructure the tree.
+    def applyCommand(self, payload):
+        if self.tree is None:
+            return
+
+        for command in payload.split(";"):
+            command = command.strip()
+            if command == "" or command.startswith("nop"):
+                continue
+            if not self.applyTargeted(command):
+                self.markDirty()
+                return
+
+
+    # applyTargeted applies a command aimed at a single container with
+    # [con_id=N], and returns whether it could.
+    def applyTargeted(self, command):
+        if not command.startswith("[con_id=") or "," in command:
+            return False
+        try:
+            con = self.byId.get(int(command[len("[con_id="):command.index("]")]))
+        except ValueError:
+            return False
+        args = command[command.index("]") + 1:].split()
+        if con is None or len(args) == 0:
+            return False
+
+        if args == ["focus"]:
+            self.setFocused(con)
+            return True
+        if args[0] == "layout" and len(args) == 2:
+            # Like sway, windows change the layout of their parent
+            target = con.parent if con.type == "con" and len(con.nodes) == 0 else con
+            return self.setLayout(target, "stacked" if args[1] == "stacking" else args[1])
+        if args[0] in ("splith", "splitv") and len(args) == 1:
+            # Sway only changes the parent's layout if the container is its
+            # only child, otherwise it's wrapped in a new container
+            parent = con.parent
+            if con.type == "con" and parent is not None and parent.nodes == [con] \
+                    and parent.layout in ("splith", "splitv"):
+                return self.setLayout(parent, args[0])
+        return False
+
+
+    def windowFocused(self, container):
+        con = self.byId.get(container.id)
+        if con is None or self.rectDrifted(con, container):
+            self.drift()
+            return
+        self.setFocused(con)
+
+
+    def windowNew(self, container):
+        if container.id in self.byId:
+            return
+
+        # Like sway, put new windows after the focused window on its workspace
+        focused = self.focused
+        if focused is None:
+            self.drift()
+            return
+        if focused.type == "workspace":
+            parent = focused
+            index = len(parent.nodes)
+        elif focused.type == "con" and focused.parent is not None and focused in focused.parent.nodes:
+            parent = focused.parent
+            index = parent.nodes.index(focused) + 1
+        else:
+            self.markDirty()
+            return
+
+        con = type(self.tree)(container.ipc_data, parent, self.con)
+        for sibling in parent.nodes:
+            sibling.percent = (sibling.percent or 1 / len(parent.nodes)) * len(parent.nodes) / (len(parent.nodes) + 1)
+        con.percent = 1 / (len(parent.nodes) + 1)
+        parent.nodes.insert(index, con)
+        self.byId[con.id] = con
+        self.arrange(parent)
+
+        # Windows can open somewhere else, like on the workspace they were
+        # launched from, which shows as a different rect
+        if (container.rect.width > 0 or container.rect.height > 0) and self.rectDrifted(con, container):
+            self.drift()
+            return
+
+        # Sway focuses new windows before the window::focus event arrives
+        self.setFocused(con)
+
+
+    def windowClosed(self, container):
+        con = self.byId.get(container.id)
+        if con is None:
+            return
+        parent = con.parent
+        self.remove(con)
+
+        # Sway moves focus to the most recently focused window that's left
+        if con is self.focused:
+            while parent.id not in self.byId:
+                parent = parent.parent
+            while len(parent.nodes) > 0:
+                children = {x.id: x for x in parent.nodes}
+                parent = next((children[x] for x in parent.focus if x in children), parent.nodes[0])
+            self.setFocused(parent)
+
+
+    def workspaceInit(self, current):
+        if current is None or current.id in self.byId:
+            return
+
+        outputs = [x for x in self.tree.nodes if x.name == current.ipc_data.get("output")]
+        if len(outputs) == 0:
+            self.markDirty()
+            return
+        workspace = type(self.tree)(current.ipc_data, outputs[0], self.con)
+        outputs[0].nodes.append(workspace)
+        for con in [workspace] + workspace.descendants():
+            self.byId[con.id] = con
+
+
+    def workspaceEmpty(self, current):
+        workspace = self.byId.get(current.id) if current is not None else None
+        if workspace is not None:
+            self.remove(workspace)
+
+
+    def workspaceFocused(self, current):
+        workspace = self.byId.get(current.id) if current is not None else None
+        if workspace is None:
+            self.drift()
+        elif len(workspace.nodes) == 0 and len(workspace.floating_nodes) == 0:
+            # Empty workspaces hold focus themselves, others get a window::focus
+            self.setFocused(workspace)
+
+
+    """
+    Helpers
+
+    The following functions edit the model in place.
+    """
+
+    def setFocused(self, con):
+        if self.focused is not None:
+            self.focused.focused = False
+        con.focused = True
+        self.focused = con
+
+        # Keep each parent's focus stack in order, it's used to refocus on close
+        child = con
+        while child.parent is not None:
+            if child.id in child.parent.focus:
+                child.parent.focus.remove(child.id)
+            child.parent.focus.insert(0, child.id)
+            child = child.parent
+
+
+    def setLayout(self, con, layout):
+        if layout not in ("splith", "splitv", "tabbed", "stacked") or con.type not in ("con", "workspace"):
+            return False
+        con.layout = layout
+        con.orientation = "vertical" if layout in ("splitv", "stacked") else "horizontal"
+        self.arrange(con)
+        return True
+
+
+    def remove(self, con):
+        parent = con.parent
+        for descendant in [con] + con.descendants():
+            self.byId.pop(descendant.id, None)
+        if con in parent.nodes:
+            parent.nodes.remove(con)
+            for sibling in parent.nodes:
+                sibling.percent = (sibling.percent or 0) / max(1 - (con.percent or 0), 0.01)
+        elif con in parent.floating_nodes:
+            parent.floating_nodes.remove(con)
+
+        if parent.type == "con" and len(parent.nodes) == 0 and len(parent.floating_nodes) == 0:
+            # Sway reaps split containers left empty
+            self.remove(parent)
+        elif parent.type in ("con", "workspace"):
+            self.arrange(parent)
+
+
+    def rectDrifted(self, con, container):
+        return abs(con.rect.x - container.rect.x) > DRIFT_TOLERANCE \
+            or abs(con.rect.y - container.rect.y) > DRIFT_TOLERANCE \
+            or abs(con.rect.width - container.rect.width) > DRIFT_TOLERANCE \
+            or abs(con.rect.height - container.rect.height) > DRIFT_TOLERANCE
+
+
+    # arrange recomputes the rects of a container's children from their
+    # percentages, the same way sway divides a split container.
+    def arrange(self, con):
+        children = con.nodes
+        if len(children) == 0:
+            return
+
+        total = sum(child.percent or 0 for child in children) or 1
+        horizontal = con.layout == "splith"
+        offset = con.rect.x if horizontal else con.rect.y
+        for child in children:
+            if con.layout in ("splith", "splitv"):
+                share = (child.percent or 0) / total
+                if horizontal:
+                    size = round(con.rect.width * share)
+                    child.rect.x, child.rect.y, child.rect.width, child.rect.height = offset, con.rect.y, size, con.rect.height
+                else:
+                    size = round(con.rect.height * share)
+                    child.rect.x, child.rect.y, child.rect.width, child.rect.height = con.rect.x, offset, con.rect.width, size
+                offset += size
+            else:
+                child.rect.x, child.rect.y = con.rect.x, con.rect.y
+                child.rect.width, child.rect.height = con.rect.width, con.rect.height
+            self.arrange(child)
+
+
+# dataOf returns a container and its children as ipc data. Containers the
+# model created or changed only have their attributes up to date.
+def dataOf(con):
+    data = dict(con.ipc_data)
+    data.update({
+        "layout": con.layout,
+        "orientation": con.orientation,
+        "percent": con.percent,
+        "focused": con.focused,
+        "focus": list(con.focus),
+        "rect": {"x": con.rect.x, "y": con.rect.y, "width": con.rect.width, "height": con.rect.height},
+        "nodes": [dataOf(x) for x in con.nodes],
+        "floating_nodes": [dataOf(x) for x in con.floating_nodes],
+    })
+    return data
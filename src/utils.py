@@ -39,7 +39,7 @@ def findFocusedWorkspace(con):
     return None if window is None else window.workspace()
 
 
-def getConfigPath():
+def parseOptions():
     parser = OptionParser()
     parser.add_option("-c",
                       "--config",
@@ -49,10 +49,39 @@ def getConfigPath():
                       callback=getCommaSeparatedArgs,
                       metavar=config.CONFIG_PATH,
                       help="Path to user config file.")
+    parser.add_option("-a",
+                      "--asyncio",
+                      dest="asyncio",
+                      action="store_true",
+                      default=False,
+                      help="Run the daemon on an asyncio event loop.")
+    parser.add_option("-r",
+                      "--record",
+                      dest="recordPath",
+                      type="string",
+                      metavar="trace.jsonl",
+                      help="Record events and commands to a trace file, compressed if it ends in .gz.")
+    return parser.parse_args()[0]
 
+
+def getConfigPath():
     try:
-        path = parser.parse_args()[0].configPath[0]
+        path = parseOptions().configPath[0]
     except:
         path = os.path.expanduser("~") + "/" + config.CONFIG_PATH
 
     return path
+
+
+def useAsyncio():
+    try:
+        return parseOptions().asyncio
+    except:
+        return False
+
+
+def getRecordPath():
+    try:
+        return parseOptions().recordPath
+    except:
+        return None
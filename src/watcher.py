@@ -0,0 +1,114 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from threading import Thread
+
+# Flags from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event is followed by a name of `len` bytes, padded with nulls
+EVENT_HEADER = struct.Struct("iIII")
+
+# Editors often save a file in a few steps, changes are handed on once the
+# directory has been quiet for this many seconds
+DEBOUNCE = 0.1
+
+
+class ConfigWatcher:
+    """
+    Watches the config directory with inotify, and calls `callback` from its
+    own thread with the set of file names that changed. The directory is
+    watched rather than the file, so editors that save by replacing the file
+    are still seen, along with user layouts added or edited next to it.
+    """
+    def __init__(self, path, callback):
+        self.path = path
+        self.callback = callback
+        self.fd = None
+        self.stopPipe = None
+
+
+    # start begins watching, it raises OSError if inotify isn't available.
+    def start(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        if libc.inotify_add_watch(fd, os.fsencode(self.path), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, os.strerror(errno), self.path)
+
+        self.fd = fd
+        self.stopPipe = os.pipe()
+        Thread(target=self.run, daemon=True).start()
+
+
+    def stop(self):
+        if self.stopPipe is not None:
+            os.write(self.stopPipe[1], b"\0")
+
+
+    def run(self):
+        changed = set()
+        while True:
+            ready = select.select([self.fd, self.stopPipe[0]], [], [], DEBOUNCE if changed else None)[0]
+            if self.stopPipe[0] in ready:
+                break
+            if self.fd in ready:
+                changed.update(self.read())
+            elif len(changed) > 0:
+                self.callback(changed)
+                changed = set()
+
+        os.close(self.fd)
+        os.close(self.stopPipe[0])
+        os.close(self.stopPipe[1])
+
+
+    # read returns the names of the files in every inotify event waiting.
+    def read(self):
+        names = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return names
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
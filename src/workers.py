@@ -0,0 +1,106 @@
+"""
+Copyright 2022 Joe Maples <joe@maples.dev>
+
+This file is part of layman.
+
+layman is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+layman is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+layman. If not, see <https://www.gnu.org/licenses/>.
+"""
+from concurrent.futures import Future
+import logging
+from queue import SimpleQueue
+from threading import Lock, Thread, current_thread
+
+
+class WorkspaceWorker:
+    """
+    Runs the manager of one workspace on a thread of its own. Tasks for a
+    workspace are run one at a time in the order they were submitted, while
+    workers for other workspaces carry on in parallel. Each worker sends
+    commands on its own connection, so a slow manager only holds up its own
+    workspace.
+    """
+    def __init__(self, num, con):
+        self.num = num
+        self.con = con
+        self.tasks = SimpleQueue()
+        self.thread = Thread(target=self.run, name="layman-workspace-%s" % num, daemon=True)
+        self.thread.start()
+
+
+    # submit queues fn to be run on the worker. snapshot is the tree layman
+    # routed the event with, the worker reuses it if it's still current.
+    def submit(self, snapshot, fn, *args):
+        future = Future()
+        self.tasks.put((future, snapshot, fn, args))
+        return future
+
+
+    # call runs fn on the worker and waits for its result. If called from the
+    # worker itself, fn is run right away.
+    def call(self, snapshot, fn, *args):
+        if current_thread() is self.thread:
+            return fn(*args)
+        return self.submit(snapshot, fn, *args).result()
+
+
+    def stop(self):
+        self.tasks.put(None)
+
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+
+            future, snapshot, fn, args = task
+            self.con.seed(snapshot)
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                logging.exception(e)
+                future.set_exception(e)
+
+
+# gather returns a future that finishes once all of the given futures have,
+# failing with the first exception raised by any of them.
+def gather(futures):
+    result = Future()
+    futures = [x for x in futures if x is not None]
+    remaining = [len(futures)]
+    lock = Lock()
+
+    def finished(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        errors = [x.exception() for x in futures if x.exception() is not None]
+        if len(errors) > 0:
+            result.set_exception(errors[0])
+        else:
+            result.set_result(None)
+
+    if len(futures) == 0:
+        result.set_result(None)
+    for future in futures:
+        future.add_done_callback(finished)
+    return result
+
+
+# chainFuture passes the outcome of one finished future on to another.
+def chainFuture(source, target):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())